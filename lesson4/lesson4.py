@@ -7,13 +7,39 @@ Student: [Your Name]
 Date: January 2026
 """
 
+import array
+import bisect
+import io
+import itertools
+import json
+import math
+import mmap
+import os
+import pickle
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
+
 # ============================================================================
 # QUESTION 2: Quick Select Implementation
 # ============================================================================
 
+# Separate generator for pivots, so selecting does not consume the caller's
+# random sequence
+_pivot_random = random.Random()
+
+
 def quick_kth(arr, left, right, k, key=lambda x: x):
     """
-    Find the k-th smallest element in arr[left:right+1] using QuickSelect algorithm.
+    Find the k-th smallest element in arr[left:right+1] using an iterative
+    introselect: QuickSelect with random median-of-three pivots that falls
+    back to median-of-medians pivots when partitions stop shrinking the range.
+    The range must halve within every three partitions, so at most O(n) work
+    is spent before the fallback and the worst case stays O(n). It never
+    recurses on the data itself.
     
     Parameters:
     - arr: the array to search in
@@ -24,23 +50,149 @@ def quick_kth(arr, left, right, k, key=lambda x: x):
     
     Returns:
     - The k-th smallest element
+    
+    On return arr is partitioned around k: everything in arr[left:k] is
+    not greater than arr[k] and everything in arr[k+1:right+1] is not smaller.
     """
-    if left == right:  # Only one element
-        return arr[left]
+    use_median_of_medians = False
+    # Size the range has to reach, and partitions spent trying to reach it
+    target = (right - left + 1) // 2
+    attempts = 0
     
-    # Partition the array and get the pivot index
-    pivot_index = partition(arr, left, right, key)
+    while left < right:
+        if use_median_of_medians:
+            pivot_index = _median_of_medians(arr, left, right, key)
+        else:
+            pivot_index = _random_median_of_three(arr, left, right, key)
+        
+        # Three-way partition, so runs of equal keys cannot stall the loop
+        lt, gt = _partition_three_way(arr, left, right, pivot_index, key)
+        
+        if k < lt:
+            right = lt - 1
+        elif k > gt:
+            left = gt + 1
+        else:
+            # k falls inside the block of elements equal to the pivot
+            return arr[k]
+        
+        if not use_median_of_medians:
+            if right - left + 1 <= target:
+                target = (right - left + 1) // 2
+                attempts = 0
+            else:
+                attempts += 1
+                if attempts >= 3:
+                    # The median-of-medians pivot always discards at least
+                    # 30% of the range
+                    use_median_of_medians = True
     
-    # The pivot is now at its final sorted position
-    # Check if it's the element we're looking for
-    if k == pivot_index:
-        return arr[k]
-    elif k < pivot_index:
-        # The k-th element is in the left partition
-        return quick_kth(arr, left, pivot_index - 1, k, key)
-    else:
-        # The k-th element is in the right partition
-        return quick_kth(arr, pivot_index + 1, right, k, key)
+    return arr[k]
+
+
+def quick_kth_many(arr, ks, key=lambda x: x):
+    """
+    Find several order statistics of arr at once (multiselect).
+    
+    The middle requested rank is selected first with quick_kth, which leaves
+    arr partitioned around it; the remaining ranks are then only searched in
+    the side that contains them. Total cost is O(n log m) for m ranks instead
+    of m independent O(n) selections over the whole array.
+    
+    Parameters:
+    - arr: the array to search in (it is rearranged in place)
+    - ks: iterable of order statistics to find (0-indexed)
+    - key: function to extract comparison key from each element
+    
+    Returns:
+    - List of the requested elements, in the same order as ks
+    """
+    ks = list(ks)
+    for k in ks:
+        if not 0 <= k < len(arr):
+            raise ValueError(f"k={k} is out of range for {len(arr)} elements")
+    
+    ranks = sorted(set(ks))
+    # Each entry is a subarray together with the slice of ranks inside it
+    stack = [(0, len(arr) - 1, 0, len(ranks))] if ranks else []
+    while stack:
+        left, right, lo, hi = stack.pop()
+        mid = (lo + hi) // 2
+        k = ranks[mid]
+        quick_kth(arr, left, right, k, key)
+        if lo < mid:
+            stack.append((left, k - 1, lo, mid))
+        if mid + 1 < hi:
+            stack.append((k + 1, right, mid + 1, hi))
+    
+    # Every requested position now holds its order statistic
+    return [arr[k] for k in ks]
+
+
+def _random_median_of_three(arr, left, right, key):
+    """
+    Return the index of the median of three random elements of
+    arr[left:right+1], so no fixed input order (sorted, reversed, organ
+    pipe) produces bad pivots every time
+    """
+    i, j, m = (_pivot_random.randint(left, right) for _ in range(3))
+    a, b, c = key(arr[i]), key(arr[j]), key(arr[m])
+    if a < b:
+        if b < c:
+            return j
+        return m if a < c else i
+    if a < c:
+        return i
+    return m if b < c else j
+
+
+def _median_of_medians(arr, left, right, key):
+    """
+    Return the index of a median-of-medians pivot for arr[left:right+1].
+    
+    The medians of groups of five are moved to the front of the range and
+    their median is found with quick_kth, so the recursion depth is only
+    O(log n) and each level works on a fifth of the data.
+    """
+    store = left
+    for group_left in range(left, right + 1, 5):
+        group_right = min(group_left + 4, right)
+        # Insertion sort of the (at most five element) group
+        for i in range(group_left + 1, group_right + 1):
+            j = i
+            while j > group_left and key(arr[j]) < key(arr[j - 1]):
+                arr[j], arr[j - 1] = arr[j - 1], arr[j]
+                j -= 1
+        median = (group_left + group_right) // 2
+        arr[store], arr[median] = arr[median], arr[store]
+        store += 1
+    
+    mid = (left + store - 1) // 2
+    quick_kth(arr, left, store - 1, mid, key)
+    return mid
+
+
+def _partition_three_way(arr, left, right, pivot_index, key):
+    """
+    Dutch national flag partition of arr[left:right+1] around arr[pivot_index].
+    
+    Returns (lt, gt) such that arr[left:lt] < pivot, arr[lt:gt+1] == pivot
+    and arr[gt+1:right+1] > pivot (all comparisons by key).
+    """
+    pivot = key(arr[pivot_index])
+    lt, i, gt = left, left, right
+    while i <= gt:
+        k = key(arr[i])
+        if k < pivot:
+            arr[lt], arr[i] = arr[i], arr[lt]
+            lt += 1
+            i += 1
+        elif pivot < k:
+            arr[i], arr[gt] = arr[gt], arr[i]
+            gt -= 1
+        else:
+            i += 1
+    return lt, gt
 
 
 def partition(arr, left, right, key=lambda x: x):
@@ -98,31 +250,415 @@ def test_quick_kth():
     print("\nTest 4: Find maximum in", arr3)
     result4 = quick_kth(arr3.copy(), 0, len(arr3) - 1, len(arr3) - 1)
     print(f"Result: {result4}")  # Should be 9
+    
+    # Test 5: Sorted input no longer degrades to quadratic time / recursion
+    arr5 = list(range(100000))
+    print("\nTest 5: Find median in sorted array of 100000 elements")
+    result5 = quick_kth(arr5, 0, len(arr5) - 1, 50000)
+    print(f"Result: {result5}")  # Should be 50000
+    
+    # Test 6: Many duplicates, the array stays partitioned around k
+    arr6 = [random.randint(0, 10) for _ in range(10000)]
+    k6 = 1234
+    result6 = quick_kth(arr6, 0, len(arr6) - 1, k6)
+    partitioned = (all(x <= result6 for x in arr6[:k6]) and
+                   all(x >= result6 for x in arr6[k6 + 1:]))
+    print(f"\nTest 6: k={k6} among duplicates -> {result6}, "
+          f"partitioned: {partitioned}")  # Should be sorted(arr6)[1234], True
+    
+    # Test 7: The number of key calls per element stays constant as sorted
+    # input grows, i.e. the work is linear
+    print("\nTest 7: Key calls per element on sorted input")
+    for n in (10000, 100000, 1000000):
+        calls = [0]
+        
+        def counting_key(x):
+            calls[0] += 1
+            return x
+        
+        arr = list(range(n))
+        quick_kth(arr, 0, n - 1, n // 2, key=counting_key)
+        print(f"  n={n}: {calls[0] / n:.1f}")  # Should be about the same for every n
+    
+    # Test 8: Several quantiles in one call
+    arr7 = list(range(1000, 0, -1))
+    ranks = [499, 899, 949, 989, 998]
+    print("\nTest 8: p50, p90, p95, p99, p99.9 of 1..1000")
+    print(f"Result: {quick_kth_many(arr7, ranks)}")  # Should be [500, 900, 950, 990, 999]
+
+
+# ============================================================================
+# Streaming Quantile Sketch (KLL)
+# ============================================================================
+
+class QuantileSketch:
+    """
+    Mergeable approximate quantile sketch (KLL, Karnin-Lang-Liberty).
+    
+    Unlike quick_kth the data is never held in memory: the sketch keeps a
+    stack of compactors, where an item in compactor h stands for 2**h
+    original items. When a compactor fills up it is sorted and every other
+    item is promoted to the next level. The memory used is O(k) and rank
+    queries are within about epsilon * n of the true rank.
+    """
+    VERSION = 1
+    
+    def __init__(self, epsilon=0.01, seed=None):
+        """
+        Initialize an empty sketch.
+        
+        Parameters:
+        - epsilon: target rank error as a fraction of the number of items
+        - seed: optional seed for the random choices made while compacting
+        """
+        if not 0 < epsilon < 1:
+            raise ValueError("epsilon must be between 0 and 1")
+        self.epsilon = epsilon
+        self.k = max(8, math.ceil(2 / epsilon))
+        self.n = 0
+        self.compactors = [[]]
+        self._random = random.Random(seed)
+        self._size = 0
+        self._max_size = self._capacity(0)
+    
+    def __len__(self):
+        """Number of items summarized by the sketch"""
+        return self.n
+    
+    def _capacity(self, h):
+        """Capacity of compactor h; lower levels shrink geometrically"""
+        depth = len(self.compactors) - h - 1
+        return int(math.ceil((2 / 3) ** depth * self.k)) + 1
+    
+    def _grow(self):
+        self.compactors.append([])
+        self._max_size = sum(self._capacity(h)
+                             for h in range(len(self.compactors)))
+    
+    def _compress(self):
+        """Compact the lowest full compactor into the level above it"""
+        for h, items in enumerate(self.compactors):
+            if len(items) >= self._capacity(h):
+                if h + 1 == len(self.compactors):
+                    self._grow()
+                items.sort()
+                # Keep the odd item out (if any) at this level
+                leftover = [items.pop()] if len(items) % 2 else []
+                offset = self._random.randint(0, 1)
+                self.compactors[h + 1].extend(items[offset::2])
+                self.compactors[h] = leftover
+                self._size = sum(len(c) for c in self.compactors)
+                return
+    
+    def update(self, value):
+        """
+        Add a value to the sketch.
+        
+        Parameters:
+        - value: the value to add (values must be mutually comparable)
+        """
+        self.compactors[0].append(value)
+        self.n += 1
+        self._size += 1
+        if self._size >= self._max_size:
+            self._compress()
+    
+    def merge(self, other):
+        """
+        Merge another sketch into this one.
+        
+        Parameters:
+        - other: a QuantileSketch, e.g. built by another worker
+        """
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for h, items in enumerate(other.compactors):
+            self.compactors[h].extend(items)
+        self.n += other.n
+        self._size = sum(len(c) for c in self.compactors)
+        while self._size >= self._max_size:
+            self._compress()
+    
+    def _weighted_items(self):
+        """Sorted list of (value, weight) pairs stored in the sketch"""
+        pairs = [(value, 1 << h)
+                 for h, items in enumerate(self.compactors)
+                 for value in items]
+        pairs.sort(key=lambda pair: pair[0])
+        return pairs
+    
+    def rank(self, value):
+        """
+        Estimate the number of summarized items smaller than value.
+        
+        Returns:
+        - Approximate 0-indexed rank of value
+        """
+        return sum((1 << h) * sum(1 for item in items if item < value)
+                   for h, items in enumerate(self.compactors))
+    
+    def quantile(self, q):
+        """
+        Estimate the q-quantile.
+        
+        Parameters:
+        - q: fraction in [0, 1]; 0.5 is the median
+        
+        Returns:
+        - A value whose rank is approximately q * (n - 1)
+        """
+        if not 0 <= q <= 1:
+            raise ValueError("q must be between 0 and 1")
+        if self.n == 0:
+            raise ValueError("Empty sketch")
+        pairs = self._weighted_items()
+        total = sum(weight for _, weight in pairs)
+        target = q * (total - 1)
+        seen = 0
+        for value, weight in pairs:
+            seen += weight
+            if seen > target:
+                return value
+        return pairs[-1][0]
+    
+    def to_bytes(self):
+        """
+        Serialize the sketch so it can be shipped to another process.
+        
+        Returns:
+        - bytes holding a versioned JSON document
+        """
+        return json.dumps({
+            "version": self.VERSION,
+            "epsilon": self.epsilon,
+            "n": self.n,
+            "compactors": self.compactors,
+        }).encode("utf-8")
+    
+    @classmethod
+    def from_bytes(cls, data, seed=None):
+        """
+        Rebuild a sketch serialized with to_bytes.
+        
+        Parameters:
+        - data: bytes produced by to_bytes
+        - seed: optional seed for future compactions
+        """
+        state = json.loads(data.decode("utf-8"))
+        if state.get("version") != cls.VERSION:
+            raise ValueError(f"Unsupported sketch version: {state.get('version')}")
+        sketch = cls(state["epsilon"], seed)
+        sketch.n = state["n"]
+        sketch.compactors = [[]]
+        while len(sketch.compactors) < len(state["compactors"]):
+            sketch._grow()
+        sketch.compactors = [list(items) for items in state["compactors"]]
+        sketch._size = sum(len(c) for c in sketch.compactors)
+        return sketch
+
+
+# Test cases for the quantile sketch
+def test_quantile_sketch():
+    print("\n" + "=" * 70)
+    print("Streaming Quantile Sketch Tests")
+    print("=" * 70)
+    
+    # Four workers each see part of the stream, then merge their sketches
+    epsilon = 0.01
+    rng = random.Random(42)
+    data = [rng.gauss(0, 1) for _ in range(100000)]
+    workers = [QuantileSketch(epsilon, seed=i) for i in range(4)]
+    for i, value in enumerate(data):
+        workers[i % 4].update(value)
+    
+    sketch = QuantileSketch.from_bytes(workers[0].to_bytes())
+    for worker in workers[1:]:
+        sketch.merge(QuantileSketch.from_bytes(worker.to_bytes()))
+    
+    print(f"\nTest 1: {len(sketch)} items summarized by "
+          f"{sum(len(c) for c in sketch.compactors)} stored values")
+    
+    # Differential test against the exact order statistics from quick_kth
+    print("\nTest 2: Rank error against quick_kth (epsilon = 0.01)")
+    n = len(data)
+    worst = 0
+    for q in (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 0.999):
+        exact = quick_kth(data.copy(), 0, n - 1, int(q * (n - 1)))
+        estimate = sketch.quantile(q)
+        error = abs(sum(1 for x in data if x < estimate) - int(q * (n - 1))) / n
+        worst = max(worst, error)
+        print(f"  q={q:<6} exact={exact:+.4f} sketch={estimate:+.4f} "
+              f"rank error={error:.4%}")
+    print(f"Within bound: {worst <= epsilon}")  # Should be True
 
 
 # ============================================================================
 # QUESTION 4: Binary Search Tree with Key Function
 # ============================================================================
 
+class _Bucket:
+    """
+    Values of a node whose key was inserted more than once.
+    
+    Only the first count entries of values belong to the bucket. Copies of
+    a node (see Node.copy) share the list and append to it; older versions
+    keep their own count and never see the new entries, so copying a bucket
+    is O(1) however many duplicates it holds.
+    """
+    __slots__ = ("values", "count")
+    
+    def __init__(self, values, count):
+        self.values = values
+        self.count = count
+    
+    def append(self, value):
+        if len(self.values) != self.count:
+            # Another copy already appended to the shared list: branch off
+            self.values = self.values[:self.count]
+        self.values.append(value)
+        self.count += 1
+
+
 class Node:
     """Node in a binary search tree"""
-    def __init__(self, value):
-        self.value = value
+    # No per-node __dict__: large indexes hold millions of these
+    __slots__ = ("item", "key", "left", "right", "height", "size")
+    
+    def __init__(self, value, key):
+        # The value itself, or a _Bucket once its key is inserted again, so
+        # nodes with distinct keys pay nothing for duplicate support
+        self.item = value
+        self.key = key  # key(value), computed once on insert
         self.left = None
         self.right = None
+        self.height = 1  # Only maintained by balanced (AVL) trees
+        self.size = 1    # Number of values in the subtree rooted here
+    
+    @property
+    def value(self):
+        """The first value inserted with this key"""
+        item = self.item
+        return item.values[0] if type(item) is _Bucket else item
+    
+    @property
+    def values(self):
+        """New list of all values sharing this key, in insert order"""
+        item = self.item
+        if type(item) is _Bucket:
+            return item.values[:item.count]
+        return [item]
+    
+    @property
+    def count(self):
+        """Number of values sharing this key"""
+        item = self.item
+        return item.count if type(item) is _Bucket else 1
+    
+    def add(self, value):
+        """Append a value with the same key to the node"""
+        item = self.item
+        if type(item) is _Bucket:
+            item.append(value)
+        else:
+            self.item = _Bucket([item, value], 2)
+    
+    def copy(self):
+        """Return an unlinked copy of the node (a bucket is shared, see _Bucket)"""
+        node = Node.__new__(Node)
+        item = self.item
+        node.item = _Bucket(item.values, item.count) if type(item) is _Bucket else item
+        node.key = self.key
+        node.left = node.right = None
+        node.height = 1
+        node.size = node.count
+        return node
+
+
+def _height(node):
+    """Height of a subtree, 0 for an empty one"""
+    return node.height if node is not None else 0
+
+
+def _size(node):
+    """Number of values in a subtree, 0 for an empty one"""
+    return node.size if node is not None else 0
+
+
+def _update(node):
+    """
+    Recompute the height and size of node from its children.
+    
+    Every operation that changes a child link (insert, rotations, bulk
+    linking, and any future delete) must call this bottom-up on the
+    affected path so order statistics stay correct.
+    """
+    node.height = 1 + max(_height(node.left), _height(node.right))
+    node.size = node.count + _size(node.left) + _size(node.right)
+
+
+def _bucket_sorted(pairs):
+    """
+    Turn (key, value) pairs sorted by key into a list of nodes, one per
+    distinct key.
+    """
+    nodes = []
+    for value_key, value in pairs:
+        if nodes and nodes[-1].key == value_key:
+            nodes[-1].add(value)
+        else:
+            if nodes and value_key < nodes[-1].key:
+                raise ValueError("values must be sorted by key")
+            nodes.append(Node(value, value_key))
+    return nodes
+
+
+def _link_balanced(nodes, lo, hi):
+    """
+    Link nodes[lo:hi] (in sorted order) into a perfectly balanced subtree.
+    
+    Recursion depth is only log2(n), and heights are set so the result is
+    a valid AVL tree.
+    
+    Returns:
+    - The root of the subtree, or None if the range is empty
+    """
+    if lo >= hi:
+        return None
+    mid = (lo + hi) // 2
+    node = nodes[mid]
+    node.left = _link_balanced(nodes, lo, mid)
+    node.right = _link_balanced(nodes, mid + 1, hi)
+    _update(node)
+    return node
+
+
+def _mermaid_label(node):
+    """Mermaid label of a node: its value, plus the bucket size if > 1"""
+    if node.count > 1:
+        return f"{node.value} x{node.count}"
+    return f"{node.value}"
 
 
 class Tree:
     """Binary Search Tree with custom key function"""
-    def __init__(self, key=lambda x: x):
+    # search_many only sorts a batch for trees of at least this many values
+    # with at least one query per SEARCH_MANY_DENSITY values; below that,
+    # sorting costs more than the shared path prefixes save
+    SEARCH_MANY_MIN_SIZE = 250000
+    SEARCH_MANY_DENSITY = 2
+    
+    def __init__(self, key=lambda x: x, balance=False):
         """
         Initialize the tree.
         
         Parameters:
         - key: function to extract the comparison key from each value
+        - balance: if True, keep the tree AVL-balanced so its height stays
+          O(log n) even for sorted input
         """
         self.root = None
         self.key = key
+        self.balance = balance
     
     def insert(self, value):
         """
@@ -131,32 +667,104 @@ class Tree:
         Parameters:
         - value: the value to insert
         """
+        if self.balance:
+            self._insert_avl(value)
+            return
+        
+        value_key = self.key(value)
         if self.root is None:
-            self.root = Node(value)
-        else:
-            self._insert_recursive(self.root, value)
+            self.root = Node(value, value_key)
+            return
+        
+        node = self.root
+        while True:
+            node.size += 1
+            if value_key == node.key:
+                # Equal keys share one node instead of forming a chain
+                node.add(value)
+                return
+            elif value_key < node.key:
+                # Go to left subtree
+                if node.left is None:
+                    node.left = Node(value, value_key)
+                    return
+                node = node.left
+            else:
+                # Go to right subtree
+                if node.right is None:
+                    node.right = Node(value, value_key)
+                    return
+                node = node.right
     
-    def _insert_recursive(self, node, value):
+    def _insert_avl(self, value):
         """
-        Recursively insert a value into the tree.
+        Insert a value and rebalance the path back to the root.
         
-        Parameters:
-        - node: current node in the recursion
-        - value: the value to insert
+        The descent records the path in a list, so no recursion is needed.
+        A value whose key is already present joins that node's bucket and
+        the shape of the tree does not change.
         """
-        # Compare using the key function
-        if self.key(value) < self.key(node.value):
-            # Go to left subtree
-            if node.left is None:
-                node.left = Node(value)
+        value_key = self.key(value)
+        path = []
+        node = self.root
+        while node is not None:
+            path.append(node)
+            if value_key == node.key:
+                node.add(value)
+                for ancestor in path:
+                    ancestor.size += 1
+                return
+            if value_key < node.key:
+                node = node.left
             else:
-                self._insert_recursive(node.left, value)
-        else:
-            # Go to right subtree (includes equal values)
-            if node.right is None:
-                node.right = Node(value)
+                node = node.right
+        
+        child = Node(value, value_key)
+        # Walk back up, linking each (possibly rotated) subtree to its parent
+        for parent in reversed(path):
+            if value_key < parent.key:
+                parent.left = child
             else:
-                self._insert_recursive(node.right, value)
+                parent.right = child
+            child = self._rebalance(parent)
+        self.root = child
+    
+    @staticmethod
+    def _rotate_left(node):
+        pivot = node.right
+        node.right = pivot.left
+        pivot.left = node
+        _update(node)
+        _update(pivot)
+        return pivot
+    
+    @staticmethod
+    def _rotate_right(node):
+        pivot = node.left
+        node.left = pivot.right
+        pivot.right = node
+        _update(node)
+        _update(pivot)
+        return pivot
+    
+    def _rebalance(self, node):
+        """
+        Restore the AVL property at node.
+        
+        Returns:
+        - The root of the (possibly rotated) subtree
+        """
+        _update(node)
+        balance = _height(node.left) - _height(node.right)
+        if balance > 1:
+            if _height(node.left.left) < _height(node.left.right):
+                node.left = self._rotate_left(node.left)
+            return self._rotate_right(node)
+        if balance < -1:
+            if _height(node.right.right) < _height(node.right.left):
+                node.right = self._rotate_right(node.right)
+            return self._rotate_left(node)
+        return node
     
     def search(self, value):
         """
@@ -166,104 +774,452 @@ class Tree:
         - value: the value to search for
         
         Returns:
-        - The node containing the value, or None if not found
+        - The node containing the value, or None if not found; node.values
+          holds every value with the same key
         """
-        return self._search_recursive(self.root, value)
+        value_key = self.key(value)
+        node = self.root
+        while node is not None:
+            if value_key == node.key:
+                return node
+            node = node.left if value_key < node.key else node.right
+        return None
     
-    def _search_recursive(self, node, value):
+    def search_many(self, values):
         """
-        Recursively search for a value.
+        Search for a batch of values in one walk over the tree.
+        
+        The queries are sorted by key and answered in ascending order, like
+        merging them with the inorder sequence. The current root-to-node
+        path is kept on a stack; each query only climbs back to the deepest
+        ancestor whose subtree can contain it and descends from there, so
+        path prefixes shared by consecutive queries are not walked again,
+        and repeated queries are answered once.
+        
+        Sorting only pays off for dense batches on large trees (see
+        SEARCH_MANY_MIN_SIZE and SEARCH_MANY_DENSITY); other batches are
+        answered by independent descents, as search would.
         
         Parameters:
-        - node: current node in the recursion
-        - value: the value to search for
+        - values: iterable of values to search for
         
         Returns:
-        - The node containing the value, or None if not found
+        - List of nodes (or None for misses), aligned with the input order
         """
-        if node is None:
-            return None
+        query_keys = [self.key(value) for value in values]
+        results = [None] * len(query_keys)
+        if self.root is None:
+            return results
         
-        # Compare using the key function
-        if self.key(value) == self.key(node.value):
-            return node
-        elif self.key(value) < self.key(node.value):
-            return self._search_recursive(node.left, value)
-        else:
-            return self._search_recursive(node.right, value)
+        size = len(self)
+        if (size < self.SEARCH_MANY_MIN_SIZE or
+                len(query_keys) * self.SEARCH_MANY_DENSITY < size):
+            root = self.root
+            for i, query_key in enumerate(query_keys):
+                node = root
+                while node is not None and node.key != query_key:
+                    node = node.left if query_key < node.key else node.right
+                results[i] = node
+            return results
+        
+        order = sorted(range(len(query_keys)), key=query_keys.__getitem__)
+        # nodes[j] is the path and every key below nodes[j] is < uppers[j]
+        # (None on the right spine). Queries only grow, so lower bounds
+        # never need to be checked.
+        nodes = [self.root]
+        uppers = [None]
+        previous = None
+        for i in order:
+            query_key = query_keys[i]
+            if previous is not None and query_key == query_keys[previous]:
+                results[i] = results[previous]
+                continue
+            previous = i
+            while uppers[-1] is not None and not query_key < uppers[-1]:
+                nodes.pop()
+                uppers.pop()
+            node = nodes[-1]
+            upper = uppers[-1]
+            while node.key != query_key:
+                if query_key < node.key:
+                    upper = node.key
+                    node = node.left
+                else:
+                    node = node.right
+                if node is None:
+                    break
+                nodes.append(node)
+                uppers.append(upper)
+            results[i] = node
+        return results
+    
+    def search_all(self, value):
+        """
+        Find every value whose key equals key(value).
+        
+        Returns:
+        - List of matching values in insert order (empty if none)
+        """
+        node = self.search(value)
+        return node.values if node is not None else []
+    
+    def __len__(self):
+        """Number of values stored in the tree"""
+        return _size(self.root)
+    
+    def select(self, k):
+        """
+        Find the k-th smallest value using subtree sizes.
+        
+        Parameters:
+        - k: the order statistic to find (0-indexed, like quick_kth)
+        
+        Returns:
+        - The k-th smallest value, in O(height) time
+        """
+        if not 0 <= k < len(self):
+            raise ValueError(f"k={k} is out of range for {len(self)} values")
+        node = self.root
+        while True:
+            left_size = _size(node.left)
+            if k < left_size:
+                node = node.left
+                continue
+            k -= left_size
+            item = node.item
+            if type(item) is not _Bucket:
+                if k == 0:
+                    return item
+                k -= 1
+            elif k < item.count:
+                return item.values[k]
+            else:
+                k -= item.count
+            node = node.right
+    
+    def _count_below(self, value_key, inclusive):
+        """Number of values whose key is < value_key (or <= if inclusive)"""
+        count = 0
+        node = self.root
+        while node is not None:
+            if node.key < value_key or (inclusive and node.key == value_key):
+                count += _size(node.left) + node.count
+                node = node.right
+            else:
+                node = node.left
+        return count
+    
+    def rank(self, value):
+        """
+        Count the values whose key is smaller than key(value).
+        
+        Returns:
+        - The 0-indexed position value would take in sorted order
+        """
+        return self._count_below(self.key(value), inclusive=False)
+    
+    def count_range(self, lo, hi):
+        """
+        Count the values whose key lies between key(lo) and key(hi), inclusive.
+        """
+        lo_key, hi_key = self.key(lo), self.key(hi)
+        if hi_key < lo_key:
+            return 0
+        return (self._count_below(hi_key, inclusive=True) -
+                self._count_below(lo_key, inclusive=False))
+    
+    def median(self):
+        """
+        Return the (lower) median value.
+        """
+        if self.root is None:
+            raise ValueError("Empty tree")
+        return self.select((len(self) - 1) // 2)
     
     def inorder_traversal(self):
         """
         Perform inorder traversal of the tree.
         
+        Uses an explicit stack, so deep (unbalanced) trees do not hit the
+        recursion limit.
+        
         Returns:
         - List of values in sorted order
         """
+        return [value for node in self._inorder_nodes() for value in node.values]
+    
+    def __iter__(self):
+        """
+        Lazily yield values in sorted order.
+        
+        Uses an explicit stack, so memory is O(height) and the first item
+        is available without visiting the whole tree.
+        """
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield from node.values
+            node = node.right
+    
+    def __reversed__(self):
+        """Lazily yield values in descending order"""
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.right
+            node = stack.pop()
+            yield from reversed(node.values)
+            node = node.left
+    
+    def range(self, lo, hi):
+        """
+        Lazily yield the values whose key lies between key(lo) and key(hi),
+        inclusive, in sorted order.
+        
+        The scan seeks to lo in O(height) and then walks forward, so taking
+        the first few items of a range does not touch the rest of the tree.
+        """
+        lo_key, hi_key = self.key(lo), self.key(hi)
+        # Seek: keep exactly the ancestors that are >= lo on the stack
+        stack = []
+        node = self.root
+        while node is not None:
+            if node.key < lo_key:
+                node = node.right
+            else:
+                stack.append(node)
+                node = node.left
+        
+        while stack:
+            node = stack.pop()
+            if hi_key < node.key:
+                return
+            yield from node.values
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+    
+    def _inorder_nodes(self):
+        """Return the list of nodes in sorted order (iteratively)"""
         result = []
-        self._inorder_recursive(self.root, result)
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            result.append(node)
+            node = node.right
         return result
     
-    def _inorder_recursive(self, node, result):
-        """Helper function for inorder traversal"""
-        if node is not None:
-            self._inorder_recursive(node.left, result)
-            result.append(node.value)
-            self._inorder_recursive(node.right, result)
+    @classmethod
+    def from_sorted(cls, values, key=lambda x: x, balance=True):
+        """
+        Build a perfectly balanced tree from values already sorted by key.
+        
+        Runs in O(n): the middle node becomes the root and each half is
+        built the same way. Neighbouring values with equal keys share one
+        node.
+        
+        Parameters:
+        - values: iterable of values in non-decreasing key order
+        - key: function to extract the comparison key from each value
+        - balance: whether later inserts should keep the tree balanced
+        
+        Returns:
+        - A new Tree
+        """
+        tree = cls(key=key, balance=balance)
+        nodes = _bucket_sorted((key(value), value) for value in values)
+        tree.root = _link_balanced(nodes, 0, len(nodes))
+        return tree
     
-    # BONUS QUESTION 5: Mermaid export functionality
-    def to_mermaid(self):
+    def bulk_insert(self, values):
         """
-        Convert the tree to Mermaid diagram format.
+        Insert a batch of values at once.
+        
+        The batch is sorted and merged with the existing inorder sequence,
+        then the tree is relinked as a perfectly balanced tree. This costs
+        O(n + m log m) instead of m separate descents from the root.
+        Existing nodes are reused, and equal keys keep the order insert
+        would give them (existing values first, then the batch in order).
+        
+        Parameters:
+        - values: iterable of values to insert
+        """
+        batch = sorted(((self.key(value), value) for value in values),
+                       key=lambda pair: pair[0])
+        if not batch:
+            return
+        existing = self._inorder_nodes()
+        
+        merged = []
+        i = 0
+        for value_key, value in batch:
+            while i < len(existing) and existing[i].key < value_key:
+                merged.append(existing[i])
+                i += 1
+            if i < len(existing) and existing[i].key == value_key:
+                existing[i].add(value)
+            elif merged and merged[-1].key == value_key:
+                merged[-1].add(value)
+            else:
+                merged.append(Node(value, value_key))
+        merged.extend(existing[i:])
+        
+        self.root = _link_balanced(merged, 0, len(merged))
+    
+    def save(self, path):
+        """
+        Write a binary snapshot of the tree to path.
+        
+        The snapshot is the sorted sequence of (key, value) records, so it
+        can be reloaded in O(n) without calling key. Layout (little endian):
+        a header (magic, version, flags, count), a table of record offsets,
+        then one record per value: length-prefixed pickled key followed by
+        length-prefixed pickled value. Only load snapshots you trust, since
+        they are unpickled.
+        
+        Parameters:
+        - path: file to write
+        """
+        count = len(self)
+        offsets = array.array("Q")
+        table_start = _SNAPSHOT_HEADER.size
+        flags = _SNAPSHOT_BALANCED if self.balance else 0
+        with open(path, "wb") as f:
+            f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION,
+                                          flags, count))
+            # Reserve the offset table, fill it in once records are written
+            position = table_start + _SNAPSHOT_OFFSET.size * count
+            f.seek(position)
+            for node in self._inorder_nodes():
+                for value in node.values:
+                    offsets.append(position)
+                    for item in (node.key, value):
+                        data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+                        f.write(_SNAPSHOT_LENGTH.pack(len(data)))
+                        f.write(data)
+                        position += _SNAPSHOT_LENGTH.size + len(data)
+            f.seek(table_start)
+            if sys.byteorder != "little":
+                offsets.byteswap()
+            f.write(offsets.tobytes())
+    
+    @classmethod
+    def load(cls, path, key=lambda x: x, mmap_mode=False):
+        """
+        Load a snapshot written by save.
+        
+        Parameters:
+        - path: snapshot file
+        - key: key function for later inserts and searches (functions are
+          not stored in the snapshot); it is not called while loading
+        - mmap_mode: if True, return a read-only MappedTree that answers
+          search directly from the memory-mapped file instead of building
+          nodes
         
         Returns:
-        - String containing Mermaid diagram code
+        - A Tree rebuilt as a perfectly balanced tree in O(n), or a
+          MappedTree if mmap_mode is set
         """
-        if self.root is None:
-            return "graph TD\n    empty[Empty Tree]"
+        if mmap_mode:
+            return MappedTree(path, key)
         
-        lines = ["graph TD"]
+        with open(path, "rb") as f:
+            data = f.read()
+        flags, count = _read_snapshot_header(data)
+        tree = cls(key=key, balance=bool(flags & _SNAPSHOT_BALANCED))
         
-        # Print root
-        lines.append(f"    t(({self.root.value}))")
+        def records():
+            position = _SNAPSHOT_HEADER.size + _SNAPSHOT_OFFSET.size * count
+            for _ in range(count):
+                node_key, position = _read_snapshot_item(data, position)
+                value, position = _read_snapshot_item(data, position)
+                yield node_key, value
         
-        # Recursively process the tree
-        self._mermaid_recursive(self.root, "t", lines)
+        nodes = _bucket_sorted(records())
+        tree.root = _link_balanced(nodes, 0, len(nodes))
+        return tree
+    
+    # BONUS QUESTION 5: Mermaid export functionality
+    def to_mermaid(self, max_depth=None, max_nodes=None):
+        """
+        Convert the tree to Mermaid diagram format.
         
-        return "\n".join(lines)
+        Parameters:
+        - max_depth, max_nodes: optional limits, see write_mermaid
+        
+        Returns:
+        - String containing Mermaid diagram code
+        """
+        stream = io.StringIO()
+        self.write_mermaid(stream, max_depth, max_nodes)
+        return stream.getvalue()
     
-    def _mermaid_recursive(self, node, node_id, lines):
+    def write_mermaid(self, stream, max_depth=None, max_nodes=None):
         """
-        Recursively generate Mermaid code for the tree.
+        Write the tree in Mermaid diagram format to a file-like stream.
+        
+        Lines are written as they are produced and the walk uses an explicit
+        stack, so memory is O(height) regardless of tree size. Nodes get
+        short numeric ids (t0, t1, ...).
         
         Parameters:
-        - node: current node
-        - node_id: string identifier for the current node
-        - lines: list to append Mermaid lines to
+        - stream: object with a write(str) method
+        - max_depth: deepest level to draw (the root is depth 0)
+        - max_nodes: maximum number of value nodes to draw
+        
+        Subtrees cut off by either limit are drawn as a single box with the
+        number of values they contain.
         """
-        if node is None:
+        stream.write("graph TD\n")
+        if self.root is None:
+            stream.write("    empty[Empty Tree]")
             return
         
-        # Process left child
-        if node.left is not None:
-            left_id = node_id + "l"
-            lines.append(f"    {node_id} --> {left_id}(({node.left.value}))")
-            self._mermaid_recursive(node.left, left_id, lines)
-        elif node.right is not None:
-            # Add empty node if left is missing but right exists
-            left_id = node_id + "l"
-            lines.append(f"    {node_id} ~~~ {left_id}(( ))")
-            lines.append(f"    style {left_id} fill:#fff,stroke-width:0px")
-        
-        # Process right child
-        if node.right is not None:
-            right_id = node_id + "r"
-            lines.append(f"    {node_id} --> {right_id}(({node.right.value}))")
-            self._mermaid_recursive(node.right, right_id, lines)
-        elif node.left is not None:
-            # Add empty node if right is missing but left exists
-            right_id = node_id + "r"
-            lines.append(f"    {node_id} ~~~ {right_id}(( ))")
-            lines.append(f"    style {right_id} fill:#fff,stroke-width:0px")
+        stream.write(f"    t0(({_mermaid_label(self.root)}))")
+        drawn = 1
+        next_id = 1
+        # Tasks run in the order the recursive export used: the left edge,
+        # the whole left subtree, then the right edge and right subtree
+        stack = [("left", self.root, "t0", 0)]
+        while stack:
+            side, node, node_id, depth = stack.pop()
+            child = node.left if side == "left" else node.right
+            other = node.right if side == "left" else node.left
+            if child is None and other is None:
+                continue  # Leaf: nothing to draw on either side
+            child_id = f"t{next_id}"
+            next_id += 1
+            
+            if child is None:
+                # Add empty node if this child is missing but the other exists
+                stream.write(f"\n    {node_id} ~~~ {child_id}(( ))")
+                stream.write(f"\n    style {child_id} fill:#fff,stroke-width:0px")
+            elif ((max_depth is not None and depth + 1 > max_depth) or
+                  (max_nodes is not None and drawn >= max_nodes)):
+                plural = "s" if child.size != 1 else ""
+                stream.write(f'\n    {node_id} --> {child_id}["... {child.size} value{plural}"]')
+            else:
+                stream.write(f"\n    {node_id} --> {child_id}(({_mermaid_label(child)}))")
+                drawn += 1
+                if side == "left":
+                    stack.append(("right", node, node_id, depth))
+                # The child's own left task queues its right task when done
+                stack.append(("left", child, child_id, depth + 1))
+                continue
+            
+            if side == "left":
+                stack.append(("right", node, node_id, depth))
 
 
 # Test cases for Question 4
@@ -314,6 +1270,76 @@ def test_bst_with_key():
     
     not_found = tree1.search(100)
     print(f"Search for 100: {'Found' if not_found else 'Not found'}")
+    
+    # Test 5: Balanced tree stays shallow on sorted input
+    print("\nTest 5: Balanced tree with 100000 sorted inserts")
+    tree5 = Tree(balance=True)
+    for val in range(100000):
+        tree5.insert(val)
+    print(f"Height: {tree5.root.height}")  # Should be 17
+    print(f"Sorted: {tree5.inorder_traversal() == list(range(100000))}")
+    found = tree5.search(99999)
+    print(f"Found value: {found.value if found else None}")
+    
+    # Test 6: Unbalanced tree deeper than the recursion limit
+    print("\nTest 6: Unbalanced tree with 3000 sorted inserts")
+    tree6 = Tree()
+    for val in range(3000):
+        tree6.insert(val)
+    print(f"Sorted: {tree6.inorder_traversal() == list(range(3000))}")
+    found = tree6.search(2999)
+    print(f"Found value: {found.value if found else None}")  # Should be 2999
+    
+    # Test 7: Bulk loading
+    print("\nTest 7: Bulk loading from sorted and unsorted batches")
+    tree7 = Tree.from_sorted(range(0, 100000, 2))
+    tree7.bulk_insert(range(99999, 0, -2))
+    print(f"Height: {tree7.root.height}")  # Should be 17
+    print(f"Sorted: {tree7.inorder_traversal() == list(range(100000))}")
+    
+    # Test 8: Order statistics from subtree sizes
+    print("\nTest 8: Order statistics on the bulk-loaded tree")
+    print(f"select(1234): {tree7.select(1234)}")  # Should be 1234
+    print(f"rank(500): {tree7.rank(500)}")  # Should be 500
+    print(f"count_range(10, 19): {tree7.count_range(10, 19)}")  # Should be 10
+    print(f"median: {tree7.median()}")  # Should be 49999
+    
+    # Test 9: Lazy iteration and range scans
+    print("\nTest 9: Lazy iteration on the bulk-loaded tree")
+    print(f"First 5: {list(itertools.islice(tree7, 5))}")  # Should be [0, 1, 2, 3, 4]
+    print(f"Last 3: {list(itertools.islice(reversed(tree7), 3))}")  # Should be [99999, 99998, 99997]
+    print(f"range(42, 47): {list(tree7.range(42, 47))}")  # Should be [42, 43, 44, 45, 46, 47]
+    
+    # Test 10: Many records sharing one key stay in a single node
+    print("\nTest 10: 100000 people with the same age")
+    tree10 = Tree(key=lambda x: x['age'])
+    for i in range(100000):
+        tree10.insert({'name': f'person{i}', 'age': 30})
+    tree10.insert({'name': 'Bob', 'age': 25})
+    matches = tree10.search_all({'age': 30})
+    print(f"Nodes: {len(tree10._inorder_nodes())}, values: {len(tree10)}")  # Should be 2, 100001
+    print(f"Matches for age 30: {len(matches)}, first: {matches[0]['name']}")
+    # Should print: Matches for age 30: 100000, first: person0
+    
+    # Test 11: Batch search keeps the input order
+    print("\nTest 11: Batch search in the bulk-loaded tree")
+    queries = [500, -1, 3, 500, 99999, 100000]
+    found = tree7.search_many(queries)
+    print([node.value if node else None for node in found])
+    # Should print: [500, None, 3, 500, 99999, None]
+    
+    # Test 12: A dense batch on a large tree takes the sorted path
+    print("\nTest 12: Dense batch search on 300000 values")
+    tree12 = Tree.from_sorted(range(0, 600000, 2))
+    queries = [random.randrange(600000) for _ in range(300000)]
+    start = time.perf_counter()
+    independent = [tree12.search(q) for q in queries]
+    independent_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batch = tree12.search_many(queries)
+    batch_time = time.perf_counter() - start
+    print(f"Same results: {batch == independent}, "
+          f"independent: {independent_time:.3f}s, batch: {batch_time:.3f}s")
 
 
 # Test cases for Bonus Question 5
@@ -362,6 +1388,590 @@ def test_mermaid_export():
         tree4.insert(val)
     
     print(tree4.to_mermaid())
+    print("=" * 70)
+    
+    # Test 5: Deep tree streamed with a node limit
+    print("\nTest 5: Right-skewed tree of 3000 nodes, first 4 nodes only")
+    tree5 = Tree()
+    for val in range(3000):
+        tree5.insert(val)
+    
+    tree5.write_mermaid(sys.stdout, max_nodes=4)
+    print()
+
+
+# ============================================================================
+# Block-Based Sorted Container
+# ============================================================================
+
+class BlockTree:
+    """
+    Sorted container with the Tree API, stored as a list of sorted blocks.
+    
+    Instead of one Python object per value, values live in plain lists of
+    bounded length (like the leaves of a B+-tree). A lookup bisects the
+    list of block maxima and then bisects inside one block, so it touches
+    two contiguous lists instead of chasing a pointer per tree level.
+    """
+    def __init__(self, key=lambda x: x, block_size=1000):
+        """
+        Initialize the container.
+        
+        Parameters:
+        - key: function to extract the comparison key from each value
+        - block_size: target number of values per block; a block is split
+          in two when it reaches twice this size
+        """
+        self.key = key
+        self.block_size = block_size
+        self._keys = []    # list of sorted key blocks
+        self._values = []  # values, parallel to _keys
+        self._maxes = []   # last key of each block
+        self._len = 0
+    
+    def __len__(self):
+        """Number of values stored"""
+        return self._len
+    
+    def insert(self, value):
+        """
+        Insert a value. Equal keys are placed after the existing ones.
+        
+        Parameters:
+        - value: the value to insert
+        """
+        value_key = self.key(value)
+        self._len += 1
+        if not self._maxes:
+            self._keys.append([value_key])
+            self._values.append([value])
+            self._maxes.append(value_key)
+            return
+        
+        i = bisect.bisect_right(self._maxes, value_key)
+        if i == len(self._maxes):
+            # Larger than everything: append to the last block
+            i -= 1
+            self._keys[i].append(value_key)
+            self._values[i].append(value)
+            self._maxes[i] = value_key
+        else:
+            j = bisect.bisect_right(self._keys[i], value_key)
+            self._keys[i].insert(j, value_key)
+            self._values[i].insert(j, value)
+        
+        if len(self._keys[i]) >= 2 * self.block_size:
+            self._split(i)
+    
+    def _split(self, i):
+        """Split block i into two halves"""
+        half = len(self._keys[i]) // 2
+        keys, values = self._keys[i], self._values[i]
+        self._keys[i:i + 1] = [keys[:half], keys[half:]]
+        self._values[i:i + 1] = [values[:half], values[half:]]
+        self._maxes[i:i + 1] = [keys[half - 1], keys[-1]]
+    
+    def _locate(self, value_key):
+        """Return (block, index) of the first key >= value_key"""
+        i = bisect.bisect_left(self._maxes, value_key)
+        if i == len(self._maxes):
+            return i, 0
+        return i, bisect.bisect_left(self._keys[i], value_key)
+    
+    def search(self, value):
+        """
+        Search for a value.
+        
+        Parameters:
+        - value: the value to search for
+        
+        Returns:
+        - The first stored value with the same key, or None if not found
+          (there are no nodes to return, unlike Tree.search)
+        """
+        value_key = self.key(value)
+        i, j = self._locate(value_key)
+        if i < len(self._keys) and self._keys[i][j] == value_key:
+            return self._values[i][j]
+        return None
+    
+    def inorder_traversal(self):
+        """
+        Return the list of values in sorted order.
+        """
+        return [value for block in self._values for value in block]
+    
+    def __iter__(self):
+        """Lazily yield values in sorted order"""
+        for block in self._values:
+            yield from block
+    
+    def range(self, lo, hi):
+        """
+        Lazily yield the values whose key lies between key(lo) and key(hi),
+        inclusive, in sorted order.
+        """
+        lo_key, hi_key = self.key(lo), self.key(hi)
+        i, j = self._locate(lo_key)
+        while i < len(self._keys):
+            keys, values = self._keys[i], self._values[i]
+            if not hi_key < keys[-1]:
+                # The whole rest of the block is in range
+                yield from values[j:]
+            else:
+                yield from values[j:bisect.bisect_right(keys, hi_key)]
+                return
+            i, j = i + 1, 0
+
+
+def benchmark_block_tree(n=1000000):
+    """
+    Compare insert and lookup times of the balanced Tree and BlockTree.
+    
+    Parameters:
+    - n: number of random values to insert and then look up
+    """
+    rng = random.Random(0)
+    values = [rng.random() for _ in range(n)]
+    queries = values[::10]
+    
+    for name, container in (("Tree(balance=True)", Tree(balance=True)),
+                            ("BlockTree", BlockTree())):
+        start = time.perf_counter()
+        for value in values:
+            container.insert(value)
+        insert_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        for value in queries:
+            container.search(value)
+        search_time = time.perf_counter() - start
+        
+        print(f"  {name:<20} insert: {insert_time:6.2f}s  "
+              f"{len(queries)} searches: {search_time:6.2f}s")
+
+
+# Test cases for the block-based container
+def test_block_tree():
+    print("\n" + "=" * 70)
+    print("Block-Based Sorted Container Tests")
+    print("=" * 70)
+    
+    # Test 1: Same API as Tree, with duplicates and a key function
+    print("\nTest 1: Tuples sorted by second element")
+    container = BlockTree(key=lambda x: x[1], block_size=2)
+    tuples = [('apple', 5), ('banana', 2), ('cherry', 8), ('date', 1), ('elder', 5)]
+    for t in tuples:
+        container.insert(t)
+    print(f"Inorder traversal: {container.inorder_traversal()}")
+    # Should print: [('date', 1), ('banana', 2), ('apple', 5), ('elder', 5), ('cherry', 8)]
+    print(f"search(('?', 8)): {container.search(('?', 8))}")  # Should be ('cherry', 8)
+    print(f"range 2..5: {list(container.range(('', 2), ('', 5)))}")
+    # Should print: [('banana', 2), ('apple', 5), ('elder', 5)]
+    
+    # Test 2: Benchmark (call benchmark_block_tree() for the 1M element run)
+    print("\nTest 2: Benchmark with 200000 random values")
+    benchmark_block_tree(200000)
+
+
+# ============================================================================
+# Tree Snapshots
+# ============================================================================
+
+_SNAPSHOT_MAGIC = b"BSTS"
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_BALANCED = 1  # flag: the tree was created with balance=True
+_SNAPSHOT_HEADER = struct.Struct("<4sHHQ")  # magic, version, flags, count
+_SNAPSHOT_OFFSET = struct.Struct("<Q")
+_SNAPSHOT_LENGTH = struct.Struct("<I")
+
+
+def _read_snapshot_header(data):
+    """
+    Validate a snapshot header.
+    
+    Returns:
+    - (flags, count)
+    """
+    if len(data) < _SNAPSHOT_HEADER.size:
+        raise ValueError("Truncated tree snapshot")
+    magic, version, flags, count = _SNAPSHOT_HEADER.unpack_from(data, 0)
+    if magic != _SNAPSHOT_MAGIC:
+        raise ValueError("Not a tree snapshot")
+    if version != _SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {version}")
+    return flags, count
+
+
+def _read_snapshot_item(data, position):
+    """
+    Unpickle one length-prefixed item.
+    
+    Returns:
+    - (item, position just after it)
+    """
+    (length,) = _SNAPSHOT_LENGTH.unpack_from(data, position)
+    position += _SNAPSHOT_LENGTH.size
+    return pickle.loads(data[position:position + length]), position + length
+
+
+class MappedTree:
+    """
+    Read-only view of a tree snapshot backed by a memory-mapped file.
+    
+    Nothing is deserialized up front: search binary-searches the offset
+    table and unpickles only the O(log n) keys it probes, plus the value
+    it finds.
+    """
+    def __init__(self, path, key=lambda x: x):
+        """
+        Map a snapshot written by Tree.save.
+        
+        Parameters:
+        - path: snapshot file
+        - key: key function used to compute the key of searched values
+        """
+        self.key = key
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # mmap cannot map an empty file
+            self._file.close()
+            raise ValueError("Truncated tree snapshot")
+        flags, self._count = _read_snapshot_header(self._map)
+        self.balance = bool(flags & _SNAPSHOT_BALANCED)
+    
+    def __len__(self):
+        """Number of values in the snapshot"""
+        return self._count
+    
+    def _offset(self, i):
+        (offset,) = _SNAPSHOT_OFFSET.unpack_from(
+            self._map, _SNAPSHOT_HEADER.size + _SNAPSHOT_OFFSET.size * i)
+        return offset
+    
+    def search(self, value):
+        """
+        Search for a value in the snapshot.
+        
+        Parameters:
+        - value: the value to search for
+        
+        Returns:
+        - A Node holding every value with the same key (like Tree.search),
+          or None
+        """
+        value_key = self.key(value)
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key, _ = _read_snapshot_item(self._map, self._offset(mid))
+            if mid_key < value_key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self._count:
+            return None
+        found_key, position = _read_snapshot_item(self._map, self._offset(lo))
+        if found_key != value_key:
+            return None
+        found_value, position = _read_snapshot_item(self._map, position)
+        node = Node(found_value, found_key)
+        # Equal keys are stored next to each other, in insert order
+        for _ in range(lo + 1, self._count):
+            next_key, position = _read_snapshot_item(self._map, position)
+            if next_key != value_key:
+                break
+            next_value, position = _read_snapshot_item(self._map, position)
+            node.add(next_value)
+        node.size = node.count
+        return node
+    
+    def __iter__(self):
+        """Lazily yield values in sorted order"""
+        position = _SNAPSHOT_HEADER.size + _SNAPSHOT_OFFSET.size * self._count
+        for _ in range(self._count):
+            _, position = _read_snapshot_item(self._map, position)
+            value, position = _read_snapshot_item(self._map, position)
+            yield value
+    
+    def inorder_traversal(self):
+        """
+        Return the list of values in sorted order.
+        """
+        return list(self)
+    
+    def close(self):
+        """Unmap and close the snapshot file"""
+        self._map.close()
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Test cases for tree snapshots
+def test_tree_snapshot():
+    print("\n" + "=" * 70)
+    print("Tree Snapshot Tests")
+    print("=" * 70)
+    
+    people = [
+        {'name': 'Alice', 'age': 30},
+        {'name': 'Bob', 'age': 25},
+        {'name': 'Charlie', 'age': 35},
+        {'name': 'David', 'age': 20}
+    ]
+    tree = Tree(key=lambda x: x['age'], balance=True)
+    for person in people:
+        tree.insert(person)
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "people.bst")
+        tree.save(path)
+        
+        # Test 1: Full load rebuilds a balanced tree
+        print("\nTest 1: Load snapshot")
+        loaded = Tree.load(path, key=lambda x: x['age'])
+        print(f"Same contents: {loaded.inorder_traversal() == tree.inorder_traversal()}")
+        print(f"Balanced: {loaded.balance}, height: {loaded.root.height}")  # Should be True, 3
+        
+        # Test 2: Memory-mapped search without deserializing the tree
+        print("\nTest 2: Memory-mapped search")
+        with Tree.load(path, key=lambda x: x['age'], mmap_mode=True) as mapped:
+            found = mapped.search({'age': 25})
+            print(f"Found value: {found.value if found else None}")  # Should be Bob
+            missing = mapped.search({'age': 99})
+            print(f"Search for age 99: {'Found' if missing else 'Not found'}")
+    
+    # Test 3: Duplicates survive a save/load round-trip
+    print("\nTest 3: Memory-mapped search with duplicate keys")
+    pairs = Tree(key=lambda x: x[0])
+    for pair in [(5, 0), (3, 0), (5, 1), (7, 0), (5, 2)]:
+        pairs.insert(pair)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "pairs.bst")
+        pairs.save(path)
+        with Tree.load(path, key=lambda x: x[0], mmap_mode=True) as mapped:
+            print(f"Found values: {mapped.search((5,)).values}")
+            # Should be [(5, 0), (5, 1), (5, 2)], the same as pairs.search_all((5,))
+
+
+# ============================================================================
+# Concurrent Tree
+# ============================================================================
+
+class ConcurrentTree(Tree):
+    """
+    AVL tree that many threads can read while one thread at a time writes.
+    
+    Nodes reachable from a published root are never modified. An insert
+    copies the nodes on its root-to-leaf path (path copying), rebalances
+    the copies, and then publishes the new root with a single attribute
+    assignment. Readers take no lock: each read operation starts from the
+    root it sees and works on that version of the tree. Writers are
+    serialized by a lock.
+    """
+    def __init__(self, key=lambda x: x, balance=True):
+        """
+        Initialize the tree.
+        
+        Parameters:
+        - key: function to extract the comparison key from each value
+        - balance: must be True; path copying relies on O(log n) paths
+        """
+        if not balance:
+            raise ValueError("ConcurrentTree is always balanced")
+        super().__init__(key=key, balance=True)
+        self._write_lock = threading.Lock()
+    
+    def insert(self, value):
+        """
+        Insert a value and atomically publish the new version of the tree.
+        
+        Parameters:
+        - value: the value to insert
+        """
+        value_key = self.key(value)
+        with self._write_lock:
+            path = []
+            node = self.root
+            while node is not None and node.key != value_key:
+                path.append(node)
+                node = node.left if value_key < node.key else node.right
+            
+            if node is None:
+                child = Node(value, value_key)
+            else:
+                # Existing key: the copy shares the bucket and appends to it
+                child = node.copy()
+                child.left, child.right = node.left, node.right
+                child.add(value)
+                _update(child)
+            # Rotations during insert only touch nodes on the path, which
+            # are all fresh copies here, so the published tree is untouched
+            for parent in reversed(path):
+                copy = parent.copy()
+                copy.left, copy.right = parent.left, parent.right
+                if value_key < copy.key:
+                    copy.left = child
+                else:
+                    copy.right = child
+                child = self._rebalance(copy)
+            self.root = child
+    
+    def bulk_insert(self, values):
+        """
+        Insert a batch of values and publish the rebuilt tree at once.
+        
+        Parameters:
+        - values: iterable of values to insert
+        """
+        with self._write_lock:
+            # Relink copies so readers of the current version are unaffected
+            staging = Tree(key=self.key, balance=True)
+            nodes = [node.copy() for node in self._inorder_nodes()]
+            staging.root = _link_balanced(nodes, 0, len(nodes))
+            staging.bulk_insert(values)
+            self.root = staging.root
+    
+    def snapshot(self):
+        """
+        Return a frozen-in-time view of the tree.
+        
+        Use it when several reads must see the same version (e.g. rank
+        followed by select). The view shares all nodes with this tree, and
+        writes to either one never affect the other.
+        """
+        view = ConcurrentTree(key=self.key)
+        view.root = self.root
+        return view
+    
+    def save(self, path):
+        """
+        Write a binary snapshot of the tree to path (see Tree.save).
+        
+        The snapshot is taken from one pinned version, so inserts published
+        while it is written cannot change the record count half way.
+        
+        Parameters:
+        - path: file to write
+        """
+        Tree.save(self.snapshot(), path)
+    
+    @classmethod
+    def load(cls, path, key=lambda x: x, mmap_mode=False):
+        """
+        Load a snapshot written by save (or by Tree.save).
+        
+        The result is always balanced, even for a snapshot of an unbalanced
+        Tree: loading relinks the nodes as a perfectly balanced tree anyway.
+        
+        Parameters:
+        - path, key, mmap_mode: as in Tree.load
+        
+        Returns:
+        - A ConcurrentTree, or a MappedTree if mmap_mode is set
+        """
+        if mmap_mode:
+            return MappedTree(path, key)
+        tree = cls(key=key)
+        tree.root = Tree.load(path, key).root
+        return tree
+
+
+def benchmark_concurrent_reads(n=200000, readers=4):
+    """
+    Measure lookup throughput while a writer thread keeps inserting.
+    
+    The tree is preloaded with n values; a writer inserts another n while
+    the reader threads search for random preloaded values.
+    
+    Parameters:
+    - n: number of preloaded values and of values inserted during the run
+    - readers: number of reader threads
+    """
+    tree = ConcurrentTree.from_sorted(range(0, 2 * n, 2))
+    done = threading.Event()
+    counts = [0] * readers
+    
+    def reader(index):
+        rng = random.Random(index)
+        while not done.is_set():
+            for _ in range(1000):
+                tree.search(2 * rng.randrange(n))
+            counts[index] += 1000
+    
+    def writer():
+        for value in range(1, 2 * n, 2):
+            tree.insert(value)
+        done.set()
+    
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    writer_thread = threading.Thread(target=writer)
+    writer_thread.start()
+    writer_thread.join()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    
+    print(f"  {readers} readers: {sum(counts) / elapsed:,.0f} searches/s, "
+          f"writer: {n / elapsed:,.0f} inserts/s")
+    return tree
+
+
+# Test cases for the concurrent tree
+def test_concurrent_tree():
+    print("\n" + "=" * 70)
+    print("Concurrent Tree Tests")
+    print("=" * 70)
+    
+    # Test 1: A snapshot does not see later inserts
+    print("\nTest 1: Snapshot isolation")
+    tree = ConcurrentTree()
+    for val in [10, 5, 15]:
+        tree.insert(val)
+    view = tree.snapshot()
+    tree.insert(7)
+    print(f"Snapshot: {view.inorder_traversal()}")  # Should be [5, 10, 15]
+    print(f"Current: {tree.inorder_traversal()}")  # Should be [5, 7, 10, 15]
+    
+    # Test 2: Read throughput under a concurrent writer
+    print("\nTest 2: Benchmark with 50000 preloaded values")
+    tree = benchmark_concurrent_reads(50000)
+    print(f"Sorted: {tree.inorder_traversal() == list(range(100000))}")
+    
+    # Test 3: Saving while a writer inserts gives loadable snapshots
+    print("\nTest 3: Save under a concurrent writer")
+    tree = ConcurrentTree.from_sorted(range(0, 20000, 2))
+    writer = threading.Thread(target=lambda: [tree.insert(v) for v in range(1, 20000, 2)])
+    valid = True
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tree.bst")
+        writer.start()
+        while writer.is_alive():
+            tree.save(path)
+            values = ConcurrentTree.load(path).inorder_traversal()
+            valid = valid and values == sorted(values) and len(values) >= 10000
+        writer.join()
+        print(f"Every snapshot loaded and sorted: {valid}")  # Should be True
+        
+        # Test 4: A snapshot of an unbalanced Tree loads as a ConcurrentTree
+        print("\nTest 4: Load a snapshot of an unbalanced Tree")
+        unbalanced = Tree()
+        for val in [1, 2, 3]:
+            unbalanced.insert(val)
+        unbalanced.save(path)
+        loaded = ConcurrentTree.load(path)
+        print(f"Values: {loaded.inorder_traversal()}, balanced: {loaded.balance}")
+        # Should print: Values: [1, 2, 3], balanced: True
 
 
 # ============================================================================
@@ -375,8 +1985,12 @@ if __name__ == "__main__":
     
     # Run all test functions
     test_quick_kth()
+    test_quantile_sketch()
     test_bst_with_key()
     test_mermaid_export()
+    test_block_tree()
+    test_tree_snapshot()
+    test_concurrent_tree()
     
     print("\n" + "=" * 70)
     print("ALL TESTS COMPLETED")
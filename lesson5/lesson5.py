@@ -1,9 +1,231 @@
+import glob
+import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 from PIL import Image
 
+CHANNEL_NAMES = ("red", "green", "blue")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".gif", ".webp", ".ppm")
+
+
+def output_prefix(path):
+    """
+    Returns the output name prefix for an image path: its directories and
+    extension joined with '_', so a.png, a.jpg and x/a.png do not clash
+    """
+    parts = os.path.normpath(path).replace(os.sep, "/").split("/")
+    return "_".join(part.replace(".", "_") for part in parts if part not in ("", "."))
+
+
+def split_channels(filename, out_dir, ext=".png", prefix=None):
+    """
+    Writes the R, G and B channels of one image to out_dir, without a GUI
+
+    Each output keeps only one channel (the others are black), like the
+    images shown by main(). The bands from a single img.split() are merged
+    with one blank band that is shared by all three outputs, which is
+    faster and needs less memory than copying the pixels through NumPy
+    (np.asarray on a Pillow image makes a full copy).
+
+    prefix defaults to output_prefix() of the file name
+
+    Returns the list of written file paths
+    """
+    img = Image.open(filename).convert("RGB")
+    bands = img.split()
+    blank = Image.new("L", img.size, 0)
+
+    if prefix is None:
+        prefix = output_prefix(os.path.basename(filename))
+    written = []
+    for c, name in enumerate(CHANNEL_NAMES):
+        planes = [blank, blank, blank]
+        planes[c] = bands[c]
+        path = os.path.join(out_dir, f"{prefix}_{name}{ext}")
+        Image.merge("RGB", planes).save(path)
+        written.append(path)
+    return written
+
+
+def find_images(pattern):
+    """
+    Returns the image files in a directory, or the files matching a glob
+    """
+    if os.path.isdir(pattern):
+        names = sorted(os.listdir(pattern))
+        return [os.path.join(pattern, name) for name in names
+                if name.lower().endswith(IMAGE_EXTENSIONS)]
+    return sorted(glob.glob(pattern))
+
+
+def batch_split(pattern, out_dir, workers=None, ext=".png"):
+    """
+    Splits every image matched by pattern (a directory or a glob) into
+    channel images in out_dir, decoding and encoding on a process pool
+
+    Output names are built from each path relative to the deepest common
+    directory, so scans/a/page1.png and scans/b/page1.png get different
+    files; a ValueError is raised before any work if two names still clash.
+
+    Prints the throughput in images per second at the end, counting only
+    the images that were split successfully
+    """
+    filenames = find_images(pattern)
+    if filenames:
+        paths = [os.path.abspath(filename) for filename in filenames]
+        root = os.path.commonpath([os.path.dirname(path) for path in paths])
+        prefixes = [output_prefix(os.path.relpath(path, root)) for path in paths]
+    else:
+        prefixes = []
+    owners = {}
+    for filename, prefix in zip(filenames, prefixes):
+        if prefix in owners:
+            raise ValueError(f"{owners[prefix]} and {filename} would both be "
+                             f"written as {prefix}_*{ext}")
+        owners[prefix] = filename
+    os.makedirs(out_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    done = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(split_channels, filename, out_dir, ext, prefix)
+                   for filename, prefix in zip(filenames, prefixes)]
+        for filename, future in zip(filenames, futures):
+            try:
+                future.result()
+                done += 1
+            except Exception as e:
+                print(f"Error: {filename}: {e}")
+                failed += 1
+    elapsed = time.perf_counter() - start
+
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"Processed {done} images in {elapsed:.2f}s ({rate:.1f} images/s)")
+    if failed:
+        print(f"Failed: {failed} images")
+
+
+def read_ppm_header(f):
+    """
+    Reads the header of a binary PPM (P6) file with 8-bit samples
+
+    The header is read byte by byte: fields may be separated by any
+    whitespace and comments, and the pixel data starts right after the
+    single whitespace byte that follows maxval (which may itself be a
+    newline or any other whitespace byte).
+
+    Returns (width, height) and leaves f positioned at the pixel data
+    """
+    tokens = []
+    token = b""
+    while len(tokens) < 4:
+        c = f.read(1)
+        if not c:
+            raise ValueError("Truncated PPM header")
+        if c == b"#":
+            # Comment up to the end of the line; it separates fields too
+            while c not in (b"\n", b"\r"):
+                c = f.read(1)
+                if not c:
+                    raise ValueError("Truncated PPM header")
+        if c.isspace():
+            if token:
+                tokens.append(token)
+                token = b""
+        else:
+            token += c
+    magic, width, height, maxval = tokens[0], int(tokens[1]), int(tokens[2]), int(tokens[3])
+    if magic != b"P6" or maxval != 255:
+        raise ValueError("Only 8-bit binary PPM (P6) files are supported")
+    return width, height
+
+
+def open_rgb_strips(filename, strip_rows):
+    """
+    Opens a binary PPM (P6) image for reading in horizontal strips of
+    strip_rows rows
+
+    The file is memory-mapped, so only the strip being processed is read
+    into memory. Other formats are rejected: Pillow decodes them whole
+    (and refuses very large ones as decompression bombs), which is what
+    tiled processing is meant to avoid.
+
+    Returns (width, height, strips), where strips yields H x W x 3 arrays
+    """
+    with open(filename, "rb") as f:
+        if f.read(2) != b"P6":
+            raise ValueError(f"{filename}: tiled mode needs a binary PPM (P6) image; "
+                             "convert it first, e.g. with vips or ImageMagick")
+        f.seek(0)
+        width, height = read_ppm_header(f)
+        offset = f.tell()
+    pixels = np.memmap(filename, dtype=np.uint8, mode="r",
+                       offset=offset, shape=(height, width, 3))
+    strips = (pixels[y:y + strip_rows] for y in range(0, height, strip_rows))
+    return width, height, strips
+
+
+def split_channels_tiled(filename, out_dir, strip_rows=256):
+    """
+    Writes the R, G and B channel images of a very large binary PPM image
+    to out_dir, keeping peak memory proportional to the strip size
+
+    The image is processed in strips of strip_rows rows, and each channel is
+    streamed strip by strip into a binary PPM file, which can be written
+    incrementally (unlike PNG or JPEG through Pillow).
+
+    Returns the list of written file paths
+    """
+    width, height, strips = open_rgb_strips(filename, strip_rows)
+    prefix = output_prefix(os.path.basename(filename))
+    paths = [os.path.join(out_dir, f"{prefix}_{name}.ppm") for name in CHANNEL_NAMES]
+    outputs = [open(path, "wb") for path in paths]
+    try:
+        for out in outputs:
+            out.write(f"P6\n{width} {height}\n255\n".encode("ascii"))
+
+        # One strip-sized buffer, reused for every strip and channel
+        tinted = np.zeros((strip_rows, width, 3), dtype=np.uint8)
+        for strip in strips:
+            rows = strip.shape[0]
+            for c, out in enumerate(outputs):
+                tinted[:rows, :, c] = strip[..., c]
+                out.write(tinted[:rows])
+                tinted[:rows, :, c] = 0
+    finally:
+        for out in outputs:
+            out.close()
+    return paths
+
+
 def main():
+    if len(sys.argv) >= 4 and sys.argv[1] == "--batch":
+        workers = int(sys.argv[4]) if len(sys.argv) == 5 else None
+        try:
+            batch_split(sys.argv[2], sys.argv[3], workers)
+        except ValueError as e:
+            print(f"Error: {e}")
+        return
+
+    if len(sys.argv) >= 4 and sys.argv[1] == "--tiled":
+        strip_rows = int(sys.argv[4]) if len(sys.argv) == 5 else 256
+        os.makedirs(sys.argv[3], exist_ok=True)
+        try:
+            paths = split_channels_tiled(sys.argv[2], sys.argv[3], strip_rows)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        for path in paths:
+            print(f"Wrote {path}")
+        return
+
     if len(sys.argv) != 2:
         print(f"Usage: python {sys.argv[0]} image-filename")
+        print(f"       python {sys.argv[0]} --batch directory-or-glob output-directory [workers]")
+        print(f"       python {sys.argv[0]} --tiled ppm-filename output-directory [strip-rows]")
         return
 
     filename = sys.argv[1]
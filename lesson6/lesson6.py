@@ -1,22 +1,98 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
 
+# Pixels per strip when histograms are computed tile by tile
+HISTOGRAM_TILE_PIXELS = 1 << 18
+# Images with fewer strips are counted in the calling thread: handing a few
+# strips to a pool costs more than it saves (e.g. every 640x480 video frame)
+HISTOGRAM_PARALLEL_STRIPS = 8
+
+# Thread pool shared by all histogram calls, created on first use
+_histogram_pool = None
+_histogram_pool_lock = threading.Lock()
+
 # ========== Question 1 ==========
 def create_gradient_image(height, width):
     """
     Creates a grayscale image with a gradual transition from black to white
     Pixel at (0,0) is black (0), pixel at (width,height) is white (255)
     """
-    img = np.zeros((height, width), dtype=np.uint8)
+    return generate_synthetic_image("gradient", height, width)
+
+
+def generate_synthetic_image(kind, height, width, dtype=np.uint8, out=None,
+                             strip_rows=1024, **params):
+    """
+    Generates a synthetic test image without per-pixel Python loops
     
-    for y in range(height):
-        for x in range(width):
-            # Formula for creating diagonal gradient
-            value = int(((x + y) / (width + height - 2)) * 255)
-            img[y, x] = value
+    Parameters:
+    kind: "gradient" - diagonal ramp from 0 at (0,0) to the dtype maximum
+                       at the opposite corner (1.0 for float dtypes)
+          "circle"   - background value fg with a filled circle of value bg,
+                       like create_low_contrast_image (params: fg, bg,
+                       optional center=(x, y) and radius)
+          "noise"    - uniform random values (params: low, high, seed)
+    height, width: image dimensions
+    dtype: pixel type of the result (ignored when out is an array)
+    out: optional array of shape (height, width) to fill in place, such as
+         an np.memmap, or a file path to create a memory-mapped raw file
+    strip_rows: rows computed at a time, so temporaries stay small even for
+                huge images
     
-    return img
+    Returns:
+    the generated image (out itself, if given)
+    """
+    if out is None:
+        out = np.empty((height, width), dtype=dtype)
+    elif isinstance(out, str):
+        out = np.memmap(out, dtype=dtype, mode="w+", shape=(height, width))
+    elif out.shape != (height, width):
+        raise ValueError("out must have shape (height, width)")
+    
+    if np.issubdtype(out.dtype, np.integer):
+        max_value = np.iinfo(out.dtype).max
+    else:
+        max_value = 1.0
+    
+    xs = np.arange(width)
+    if kind == "gradient":
+        # Same formula as the original per-pixel loop; the assignment into
+        # an integer image truncates like int()
+        scale = max(width + height - 2, 1)
+        for y0 in range(0, height, strip_rows):
+            ys = np.arange(y0, min(y0 + strip_rows, height))[:, None]
+            out[y0:y0 + len(ys)] = ((xs + ys) / scale) * max_value
+    elif kind == "circle":
+        cx, cy = params.get("center", (width // 2, height // 2))
+        radius = params.get("radius", min(width, height) // 4)
+        dx2 = (xs - cx) ** 2
+        for y0 in range(0, height, strip_rows):
+            ys = np.arange(y0, min(y0 + strip_rows, height))[:, None]
+            inside = dx2 + (ys - cy) ** 2 <= radius * radius
+            out[y0:y0 + len(ys)] = np.where(inside, params["bg"], params["fg"])
+    elif kind == "noise":
+        rng = np.random.default_rng(params.get("seed"))
+        low = params.get("low", 0)
+        high = params.get("high", max_value)
+        for y0 in range(0, height, strip_rows):
+            rows = min(strip_rows, height - y0)
+            if np.issubdtype(out.dtype, np.integer):
+                out[y0:y0 + rows] = rng.integers(low, high, (rows, width),
+                                                 dtype=out.dtype, endpoint=True)
+            else:
+                out[y0:y0 + rows] = rng.uniform(low, high, (rows, width))
+    else:
+        raise ValueError("kind must be 'gradient', 'circle' or 'noise'")
+    
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
 
 
 # ========== Question 2 ==========
@@ -110,47 +186,204 @@ def create_low_contrast_image(fg, bg, size=400):
 
 
 # ========== Question 5 ==========
-def normalize(img):
+def normalize(img, out=None, verbose=False, stats=None):
     """
     Performs normalization on an image
     The minimum value in the image will be 0, and the maximum 255
     Implemented without using cv2.normalize()
     
+    For uint8 and uint16 images the min, max and mean come from one
+    histogram pass, the normalization formula is evaluated once per gray
+    level into a lookup table, and the table is applied in a single pass,
+    so no full-size float temporaries are created. Other dtypes use the
+    direct float computation. The results are identical either way.
+    
     Parameters:
     img: input grayscale image
+    out: optional uint8 array of the same shape to write the result into
+    verbose: print the statistics before and after normalization
+    stats: optional callable that receives a dict with the statistics
+           (min, max, mean, stretch, and out_min, out_max, out_mean)
     
     Returns:
-    normalized image
+    normalized image (out itself, if given)
     """
-    # Convert to float to prevent calculation issues
-    src_float = img.astype(np.float32)
+    if img.size == 0:
+        raise ValueError("Cannot normalize an empty image")
     
-    # Calculate min and max
-    min_val = np.min(src_float)
-    max_val = np.max(src_float)
-    mean_val = np.mean(src_float)
+    if img.dtype in (np.uint8, np.uint16):
+        hist = _flat_histogram(img)
+        min_val, max_val, mean_val = _histogram_stats(hist)
+        lut = _normalize_lut(len(hist), np.float32(min_val), np.float32(max_val))
+        dst = _apply_lut(img, lut, out)
+        if verbose or stats is not None:
+            # The output statistics follow from the table and the histogram
+            out_min, out_max, out_mean = _histogram_stats(np.bincount(
+                lut, weights=hist, minlength=256))
+    else:
+        # Convert to float to prevent calculation issues
+        src_float = img.astype(np.float32)
+        min_val = np.min(src_float)
+        max_val = np.max(src_float)
+        mean_val = np.mean(src_float)
+        
+        # Normalization formula
+        if max_val - min_val != 0:
+            dst_float = ((src_float - min_val) * 255) / (max_val - min_val)
+        else:
+            dst_float = src_float
+        
+        # Convert back to uint8
+        dst = np.clip(dst_float, 0, 255).astype(np.uint8)
+        if out is not None:
+            np.copyto(out, dst)
+            dst = out
+        if verbose or stats is not None:
+            out_min, out_max, out_mean = np.min(dst), np.max(dst), np.mean(dst)
     
-    print(f"Before normalization:")
-    print(f"  Min: {min_val}")
-    print(f"  Max: {max_val}")
-    print(f"  Mean: {mean_val:.2f}")
-    print(f"  Stretch factor: {255 / (max_val - min_val):.2f}")
+    if verbose or stats is not None:
+        spread = float(max_val) - float(min_val)
+        info = {
+            "min": float(min_val), "max": float(max_val), "mean": float(mean_val),
+            "stretch": 255 / spread if spread != 0 else float("inf"),
+            "out_min": int(out_min), "out_max": int(out_max), "out_mean": float(out_mean),
+        }
+        if stats is not None:
+            stats(info)
+        if verbose:
+            _print_normalize_stats(info)
+    
+    return dst
+
+
+def normalize_robust(img, low=1.0, high=99.0, out=None, verbose=False, stats=None):
+    """
+    Performs outlier-resistant normalization (percentile contrast stretch)
+    The low percentile of the image becomes 0 and the high percentile 255;
+    values outside that range are clipped
     
-    # Normalization formula
+    Both percentiles are read from the cumulative histogram, so the cost
+    is one counting pass plus one lookup-table pass, about the same as
+    normalize() and without sorting the pixels.
+    
+    Parameters:
+    img: input grayscale image, uint8 or uint16
+    low, high: percentiles in [0, 100] mapped to 0 and 255
+    out: optional uint8 array of the same shape to write the result into
+    verbose, stats: as in normalize(); min and max are the percentile levels
+    
+    Returns:
+    normalized image (out itself, if given)
+    """
+    if img.dtype not in (np.uint8, np.uint16):
+        raise ValueError("img must be uint8 or uint16")
+    if not 0 <= low <= high <= 100:
+        raise ValueError("percentiles must satisfy 0 <= low <= high <= 100")
+    if img.size == 0:
+        raise ValueError("Cannot normalize an empty image")
+    
+    hist = _flat_histogram(img)
+    low_val = _histogram_percentile(hist, low)
+    high_val = _histogram_percentile(hist, high)
+    lut = _normalize_lut(len(hist), np.float32(low_val), np.float32(high_val))
+    dst = _apply_lut(img, lut, out)
+    
+    if verbose or stats is not None:
+        _, _, mean_val = _histogram_stats(hist)
+        out_min, out_max, out_mean = _histogram_stats(np.bincount(
+            lut, weights=hist, minlength=256))
+        spread = float(high_val) - float(low_val)
+        info = {
+            "min": float(low_val), "max": float(high_val), "mean": float(mean_val),
+            "stretch": 255 / spread if spread != 0 else float("inf"),
+            "out_min": int(out_min), "out_max": int(out_max), "out_mean": float(out_mean),
+        }
+        if stats is not None:
+            stats(info)
+        if verbose:
+            _print_normalize_stats(info)
+    
+    return dst
+
+
+def _histogram_percentile(hist, percentile):
+    """
+    Returns the gray level at the given percentile of the pixels counted in
+    hist (the same as np.percentile with method="lower")
+    """
+    rank = int(percentile / 100 * (hist.sum() - 1))
+    return int(np.searchsorted(np.cumsum(hist), rank, side="right"))
+
+
+def _print_normalize_stats(info):
+    """
+    Prints the statistics dict that normalize() passes to its stats callback
+    """
+    print(f"Before normalization:")
+    print(f"  Min: {info['min']}")
+    print(f"  Max: {info['max']}")
+    print(f"  Mean: {info['mean']:.2f}")
+    print(f"  Stretch factor: {info['stretch']:.2f}")
+    print(f"\nAfter normalization:")
+    print(f"  Min: {info['out_min']}")
+    print(f"  Max: {info['out_max']}")
+    print(f"  Mean: {info['out_mean']:.2f}")
+
+
+def _flat_histogram(img):
+    """
+    Full-resolution histogram (one bin per gray level) of a uint8/uint16
+    image of any shape
+    """
+    levels = 256 if img.dtype == np.uint8 else 65536
+    if img.ndim != 2:
+        img = img.reshape(-1, img.shape[-1]) if img.ndim > 2 else img.reshape(1, -1)
+    return calculate_histogram(img, bins=levels)
+
+
+def _histogram_stats(hist):
+    """
+    Returns (min, max, mean) of the gray levels counted in hist
+    """
+    present = np.flatnonzero(hist)
+    mean = np.dot(np.arange(len(hist), dtype=np.float64), hist) / hist.sum()
+    return present[0], present[-1], mean
+
+
+def _normalize_lut(levels, min_val, max_val):
+    """
+    Evaluates the normalization formula of normalize() in float32 for every
+    gray level, giving a uint8 lookup table
+    """
+    src_float = np.arange(levels, dtype=np.float32)
     if max_val - min_val != 0:
         dst_float = ((src_float - min_val) * 255) / (max_val - min_val)
     else:
         dst_float = src_float
+    return np.clip(dst_float, 0, 255).astype(np.uint8)
+
+
+def _apply_lut(img, lut, out=None):
+    """
+    Maps every pixel of a uint8/uint16 image through lut in one pass
     
-    # Convert back to uint8
-    dst = np.clip(dst_float, 0, 255).astype(np.uint8)
-    
-    print(f"\nAfter normalization:")
-    print(f"  Min: {np.min(dst)}")
-    print(f"  Max: {np.max(dst)}")
-    print(f"  Mean: {np.mean(dst):.2f}")
-    
-    return dst
+    If out is given the result is always written into it (it must have the
+    shape of img and the dtype of lut) and out is returned.
+    """
+    if out is not None:
+        if out.shape != img.shape:
+            raise ValueError("out must have the same shape as img")
+        if out.dtype != lut.dtype:
+            raise ValueError(f"out must have dtype {lut.dtype}")
+    # cv2.LUT only writes into a C-contiguous dst; otherwise it would
+    # silently return a new array
+    if (img.dtype == np.uint8 and lut.dtype == np.uint8 and len(lut) == 256 and
+            (out is None or out.flags.c_contiguous)):
+        return cv2.LUT(img, lut, dst=out)
+    if out is None:
+        out = np.empty(img.shape, dtype=lut.dtype)
+    # mode="clip" avoids the extra output buffer np.take uses by default
+    return np.take(lut, img, out=out, mode="clip")
 
 
 def test_normalization():
@@ -161,7 +394,7 @@ def test_normalization():
     low_contrast = create_low_contrast_image(100, 105)
     
     # Normalize
-    normalized = normalize(low_contrast)
+    normalized = normalize(low_contrast, verbose=True)
     
     # Display
     plt.figure(figsize=(12, 5))
@@ -194,20 +427,28 @@ def test_normalization_with_outliers():
     img[0, 1] = 255
     
     print("=== Image with outliers ===")
-    normalized = normalize(img)
+    normalized = normalize(img, verbose=True)
     
-    plt.figure(figsize=(12, 5))
+    print("\n=== Robust normalization (1st-99th percentile) ===")
+    robust = normalize_robust(img, 1, 99, verbose=True)
     
-    plt.subplot(1, 2, 1)
+    plt.figure(figsize=(18, 5))
+    
+    plt.subplot(1, 3, 1)
     plt.imshow(img, cmap='gray')
     plt.title('With Outliers (0, 100-105, 255)')
     plt.axis('off')
     
-    plt.subplot(1, 2, 2)
+    plt.subplot(1, 3, 2)
     plt.imshow(normalized, cmap='gray')
     plt.title('After Normalization')
     plt.axis('off')
     
+    plt.subplot(1, 3, 3)
+    plt.imshow(robust, cmap='gray')
+    plt.title('After Robust Normalization')
+    plt.axis('off')
+    
     plt.tight_layout()
     plt.show()
     
@@ -215,31 +456,86 @@ def test_normalization_with_outliers():
     print("Two individual pixels (0 and 255) cause normalization to stretch the entire range.")
     print("As a result, the small differences between 100 and 105 become very small (almost invisible).")
     print("This is a known problem with normalization - sensitivity to outliers.")
+    print("Stretching between percentiles of the histogram ignores the outliers,")
+    print("so 100 and 105 are mapped to 0 and 255 again.")
 
 
 # ========== Question 7 ==========
-def calculate_histogram(img):
+def calculate_histogram(img, mask=None, bins=256, tile_rows=None, workers=None):
     """
     Calculates the histogram of a grayscale image
-    Without using library functions
+    
+    The image is cut into strips of rows; each strip is counted
+    with a vectorized np.bincount on a thread pool (NumPy releases the GIL
+    while counting) and the partial histograms are summed.
     
     Parameters:
-    img: grayscale image
+    img: grayscale image, uint8 or uint16
+    mask: optional boolean array of the same shape; only pixels where it is
+          True are counted
+    bins: number of bins; gray level v falls in bin v * bins // levels,
+          where levels is 256 for uint8 and 65536 for uint16 images
+    tile_rows: rows per strip (by default about 256K pixels per strip,
+               which bounds the temporary index arrays np.bincount makes)
+    workers: thread pool size (None uses a pool shared by all calls, 1
+             counts in the calling thread); images with fewer than
+             HISTOGRAM_PARALLEL_STRIPS strips are always counted serially
     
     Returns:
-    histogram array with 256 elements (one for each gray level)
+    int32 histogram array with bins elements (for a uint8 image and the
+    default bins, one element for each gray level)
     """
-    # Create array of 256 bins (for each gray level)
-    histogram = np.zeros(256, dtype=np.int32)
+    if img.ndim == 3:
+        raise ValueError("img is a color image; use calculate_channel_histograms()")
+    if img.ndim != 2:
+        raise ValueError("img must be a 2D grayscale image")
+    if img.dtype == np.uint8:
+        levels = 256
+    elif img.dtype == np.uint16:
+        levels = 65536
+    else:
+        raise ValueError("img must be uint8 or uint16")
+    if not 1 <= bins <= levels:
+        raise ValueError(f"bins must be between 1 and {levels}")
+    if mask is not None and mask.shape != img.shape:
+        raise ValueError("mask must have the same shape as img")
+    if tile_rows is None:
+        tile_rows = max(1, HISTOGRAM_TILE_PIXELS // max(img.shape[1], 1))
     
-    # Count each pixel value
-    height, width = img.shape
-    for y in range(height):
-        for x in range(width):
-            pixel_value = img[y, x]
-            histogram[pixel_value] += 1
+    def count_strip(y0):
+        strip = img[y0:y0 + tile_rows]
+        if mask is not None:
+            values = strip[mask[y0:y0 + tile_rows]]
+        else:
+            values = strip.ravel()
+        return np.bincount(values, minlength=levels)
+    
+    # At least one (possibly empty) strip, so an empty image gives zeros
+    starts = range(0, max(img.shape[0], 1), tile_rows)
+    counts = sum(_map_strips(count_strip, starts, workers))
     
-    return histogram
+    if bins != levels:
+        # First gray level of every bin, then sum the levels of each bin
+        edges = (np.arange(bins) * levels + bins - 1) // bins
+        counts = np.add.reduceat(counts, edges)
+    return counts.astype(np.int32)
+
+
+def _map_strips(count_strip, starts, workers):
+    """
+    Returns [count_strip(y0) for y0 in starts], computed on a thread pool
+    when there are enough strips (see calculate_histogram() for workers)
+    """
+    global _histogram_pool
+    if workers == 1 or len(starts) < HISTOGRAM_PARALLEL_STRIPS:
+        return [count_strip(y0) for y0 in starts]
+    if workers is not None:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(count_strip, starts))
+    with _histogram_pool_lock:
+        if _histogram_pool is None:
+            _histogram_pool = ThreadPoolExecutor(thread_name_prefix="histogram")
+    return list(_histogram_pool.map(count_strip, starts))
 
 
 def display_histogram(img):
@@ -271,6 +567,766 @@ def display_histogram(img):
     plt.show()
 
 
+# ========== Color histograms ==========
+def calculate_channel_histograms(img, bins=256, joint_bins=None, joint_channels=None,
+                                 mask=None, tile_rows=None, workers=None):
+    """
+    Calculates the histograms and statistics of every channel of a color
+    image in one pass
+    
+    The interleaved pixels are counted strip by strip, like
+    calculate_histogram(). Within a strip, every channel is counted through
+    a strided view, so no channel is ever copied out of the image, and the
+    statistics come from the histograms rather than from more passes.
+    
+    Parameters:
+    img: H x W x C image, uint8 or uint16
+    bins: number of bins of each per-channel histogram
+    joint_bins: if given, also count a joint histogram of the channels in
+                joint_channels, each quantized to joint_bins bins
+    joint_channels: channels of the joint histogram (default: all of them,
+                    so an RGB image gets a 3D histogram)
+    mask: optional boolean H x W array; only pixels where it is True count
+    tile_rows, workers: as for calculate_histogram()
+    
+    Returns:
+    dict with "hist" (C x bins int32 array), "min", "max", "mean" and "std"
+    (arrays with one value per channel, computed from the full-resolution
+    counts), and "joint" (an array with one axis per joint channel) when
+    joint_bins is given
+    """
+    if img.ndim != 3:
+        raise ValueError("img must be an H x W x C color image")
+    if img.dtype == np.uint8:
+        levels = 256
+    elif img.dtype == np.uint16:
+        levels = 65536
+    else:
+        raise ValueError("img must be uint8 or uint16")
+    if not 1 <= bins <= levels:
+        raise ValueError(f"bins must be between 1 and {levels}")
+    if mask is not None and mask.shape != img.shape[:2]:
+        raise ValueError("mask must have the shape of one channel of img")
+    height, width, channels = img.shape
+    if joint_channels is None:
+        joint_channels = range(channels)
+    joint_channels = list(joint_channels)
+    if tile_rows is None:
+        tile_rows = max(1, HISTOGRAM_TILE_PIXELS // max(width * channels, 1))
+    
+    def count_strip(y0):
+        strip = img[y0:y0 + tile_rows].reshape(-1, channels)
+        if mask is not None:
+            strip = strip[mask[y0:y0 + tile_rows].ravel()]
+        # Strided column views: np.bincount reads each channel in place
+        counts = np.stack([np.bincount(strip[:, c], minlength=levels)
+                           for c in range(channels)])
+        joint = None
+        if joint_bins is not None:
+            joint = np.zeros(len(strip), dtype=np.intp)
+            for c in joint_channels:
+                joint *= joint_bins
+                joint += strip[:, c].astype(np.intp) * joint_bins // levels
+            joint = np.bincount(joint, minlength=joint_bins ** len(joint_channels))
+        return counts, joint
+    
+    parts = _map_strips(count_strip, range(0, max(height, 1), tile_rows), workers)
+    
+    counts = sum(part[0] for part in parts)
+    result = {"min": [], "max": [], "mean": [], "std": []}
+    gray_levels = np.arange(levels, dtype=np.float64)
+    for hist in counts:
+        if hist.sum() == 0:
+            raise ValueError("No pixels to count")
+        min_val, max_val, mean = _histogram_stats(hist)
+        result["min"].append(min_val)
+        result["max"].append(max_val)
+        result["mean"].append(mean)
+        result["std"].append(np.sqrt(np.dot((gray_levels - mean) ** 2, hist) / hist.sum()))
+    result = {name: np.array(values) for name, values in result.items()}
+    
+    if bins != levels:
+        edges = (np.arange(bins) * levels + bins - 1) // bins
+        counts = np.add.reduceat(counts, edges, axis=1)
+    result["hist"] = counts.astype(np.int32)
+    if joint_bins is not None:
+        joint = sum(part[1] for part in parts)
+        result["joint"] = joint.reshape((joint_bins,) * len(joint_channels)).astype(np.int32)
+    return result
+
+
+def test_channel_histograms():
+    """
+    Compares the single-pass color histograms with per-channel passes
+    """
+    rng = np.random.default_rng(0)
+    rgb = np.dstack([generate_synthetic_image("gradient", 768, 1024),
+                     rng.integers(0, 256, (768, 1024), dtype=np.uint8),
+                     np.full((768, 1024), 77, dtype=np.uint8)])
+    
+    start = time.perf_counter()
+    result = calculate_channel_histograms(rgb)
+    single_time = time.perf_counter() - start
+    
+    # The old way: split the channels, then histogram and summarize each
+    start = time.perf_counter()
+    separate = []
+    for c in range(3):
+        channel = np.ascontiguousarray(rgb[..., c])
+        separate.append(calculate_histogram(channel))
+        channel.min(), channel.max(), channel.mean(), channel.std()
+    separate_time = time.perf_counter() - start
+    
+    result["joint"] = calculate_channel_histograms(rgb, joint_bins=8)["joint"]
+    
+    print(f"Per-channel histograms match: {np.array_equal(result['hist'], separate)}")
+    expected_joint, _ = np.histogramdd((rgb.reshape(-1, 3) // 32).astype(float),
+                                       bins=8, range=[(0, 8)] * 3)
+    print(f"Joint 8x8x8 histogram matches: {np.array_equal(result['joint'], expected_joint)}")
+    pixels = rgb.reshape(-1, 3)
+    print(f"Stats match: {np.allclose(result['mean'], pixels.mean(axis=0)) and np.allclose(result['std'], pixels.std(axis=0))}")
+    for c, name in enumerate(("red", "green", "blue")):
+        print(f"  {name:<5}: min {result['min'][c]}, max {result['max'][c]}, "
+              f"mean {result['mean'][c]:.2f}, std {result['std'][c]:.2f}")
+    print(f"Single pass: {single_time:.4f}s, split channels: {separate_time:.4f}s")
+
+
+# ========== Point operation pipelines ==========
+class PointOps:
+    """
+    A chain of per-pixel operations compiled into one lookup table
+    
+    Every step maps a gray level to a gray level, so the whole chain is a
+    single function of the input level. compile() runs the steps on a
+    table holding every possible level (256 for uint8, 65536 for uint16)
+    and apply() maps the image through that table in one pass, instead of
+    one full traversal and allocation per step. Because the steps run on
+    the table with the same functions (brighten, normalize formula, ...),
+    the result is identical to running them one after another, including
+    np.add wraparound versus cv2.add saturation.
+    
+    Example:
+        ops = PointOps().add(50, "cv2").normalize().gamma(0.8)
+        result = ops.apply(img)
+    """
+    
+    def __init__(self):
+        self.steps = []
+    
+    def add(self, b, func="cv2"):
+        """Adds b to each pixel, like brighten(img, b, func)"""
+        if func not in ("np", "cv2"):
+            raise ValueError("func must be 'np' or 'cv2'")
+        self.steps.append(("add", b, func))
+        return self
+    
+    def stretch(self, low, high):
+        """Linearly maps [low, high] to the full range of the dtype, clipping"""
+        self.steps.append(("stretch", low, high))
+        return self
+    
+    def gamma(self, g):
+        """Applies gamma correction: max * (v / max) ** g, rounded"""
+        self.steps.append(("gamma", g))
+        return self
+    
+    def clip(self, low, high):
+        """Clips pixel values to [low, high]"""
+        self.steps.append(("clip", low, high))
+        return self
+    
+    def normalize(self):
+        """Same as normalize(): the range at this point becomes 0..255 (uint8)"""
+        self.steps.append(("normalize",))
+        return self
+    
+    def normalize_robust(self, low=1.0, high=99.0):
+        """Same as normalize_robust(low, high) at this point of the chain"""
+        self.steps.append(("normalize_robust", low, high))
+        return self
+    
+    def needs_histogram(self):
+        """True if a step depends on the image content (normalization)"""
+        return any(step[0].startswith("normalize") for step in self.steps)
+    
+    def compile(self, dtype=np.uint8, hist=None):
+        """
+        Builds the lookup table of the chain
+        
+        Parameters:
+        dtype: input image type, uint8 or uint16
+        hist: full-resolution histogram of the input image (one bin per
+              level); required when the chain contains a normalization
+        
+        Returns:
+        table with one entry per input level
+        """
+        if dtype not in (np.uint8, np.uint16):
+            raise ValueError("dtype must be uint8 or uint16")
+        if hist is None and self.needs_histogram():
+            raise ValueError("a histogram is needed to compile normalization steps")
+        
+        # Row vector, since cv2 functions expect a 2D image
+        table = np.arange(np.iinfo(dtype).max + 1, dtype=dtype)[np.newaxis, :]
+        for step in self.steps:
+            op = step[0]
+            if op == "add":
+                table = brighten(table, step[1], step[2])
+            elif op == "stretch":
+                max_value = np.iinfo(table.dtype).max
+                low, high = step[1], step[2]
+                scaled = (table.astype(np.float64) - low) * max_value / max(high - low, 1)
+                table = np.clip(scaled, 0, max_value).astype(table.dtype)
+            elif op == "gamma":
+                max_value = np.iinfo(table.dtype).max
+                corrected = max_value * (table / max_value) ** step[1]
+                table = np.clip(np.rint(corrected), 0, max_value).astype(table.dtype)
+            elif op == "clip":
+                table = np.clip(table, step[1], step[2]).astype(table.dtype)
+            else:
+                # Histogram of the image as it looks at this point of the chain
+                levels = np.iinfo(table.dtype).max + 1
+                stage_hist = np.bincount(table.ravel(), weights=hist, minlength=levels)
+                if op == "normalize":
+                    low, high, _ = _histogram_stats(stage_hist)
+                else:
+                    low = _histogram_percentile(stage_hist, step[1])
+                    high = _histogram_percentile(stage_hist, step[2])
+                lut = _normalize_lut(levels, np.float32(low), np.float32(high))
+                table = lut[table]
+        return table.ravel()
+    
+    def apply(self, img, out=None):
+        """
+        Runs the chain on an image in a single pass
+        
+        Parameters:
+        img: uint8 or uint16 image
+        out: optional array of the result's shape and dtype
+        
+        Returns:
+        the processed image (out itself, if given)
+        """
+        hist = _flat_histogram(img) if self.needs_histogram() else None
+        return _apply_lut(img, self.compile(img.dtype, hist), out)
+
+
+# ========== Tiled processing of raw image files ==========
+def open_raw_image(path, shape, dtype=np.uint8, mode="r"):
+    """
+    Memory-maps a headerless raw image file of the given shape and dtype
+    """
+    return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+
+
+def raw_histogram(path, shape, dtype=np.uint8, bins=256, tile_rows=256, workers=None):
+    """
+    Calculates the histogram of a raw image file tile by tile
+    
+    Only tile_rows rows per worker are in memory at a time.
+    """
+    src = open_raw_image(path, shape, dtype)
+    return calculate_histogram(src, bins=bins, tile_rows=tile_rows, workers=workers)
+
+
+def process_raw_image(src_path, dst_path, shape, ops, dtype=np.uint8,
+                      tile_rows=256, workers=None):
+    """
+    Runs a PointOps chain over a raw image file and writes the result to
+    another raw file, tile by tile
+    
+    If the chain contains a normalization, a first pass over the tiles
+    builds the global histogram (which gives the global min/max); the second
+    pass maps every tile through the compiled table straight into the
+    memory-mapped output. Peak memory depends on tile_rows, not on the
+    image size.
+    
+    Parameters:
+    src_path, dst_path: headerless raw files (dst is created/overwritten)
+    shape: (height, width) of the image
+    ops: a PointOps chain, e.g. PointOps().add(50, "cv2") for brighten or
+         PointOps().normalize() for normalize
+    dtype: pixel type of the input, uint8 or uint16
+    tile_rows: rows per tile
+    workers: thread pool size (None lets the executor choose, 1 runs the
+             tiles in the calling thread)
+    
+    Returns:
+    the output image as a read-only memory map
+    """
+    src = open_raw_image(src_path, shape, dtype)
+    hist = None
+    if ops.needs_histogram():
+        hist = calculate_histogram(src, bins=np.iinfo(dtype).max + 1,
+                                   tile_rows=tile_rows, workers=workers)
+    table = ops.compile(dtype, hist)
+    
+    dst = open_raw_image(dst_path, shape, table.dtype, mode="w+")
+    
+    def process_tile(y0):
+        # Plain ndarray views of the mapped memory, so cv2 writes in place
+        tile_out = np.asarray(dst[y0:y0 + tile_rows])
+        _apply_lut(np.asarray(src[y0:y0 + tile_rows]), table, tile_out)
+    
+    starts = range(0, shape[0], tile_rows)
+    if workers == 1:
+        for y0 in starts:
+            process_tile(y0)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(process_tile, starts))
+    dst.flush()
+    del dst
+    return open_raw_image(dst_path, shape, table.dtype)
+
+
+def test_point_ops():
+    """
+    Compares a compiled chain with running the same steps one by one
+    """
+    img = create_gradient_image(300, 400)
+    
+    for func in ("np", "cv2"):
+        fused = PointOps().add(100, func).normalize().gamma(0.5).apply(img)
+        
+        step = brighten(img, 100, func)
+        step = normalize(step)
+        step = np.clip(np.rint(255 * (step / 255) ** 0.5), 0, 255).astype(np.uint8)
+        
+        print(f"add(100, {func!r}) -> normalize -> gamma(0.5): "
+              f"identical to separate steps: {np.array_equal(fused, step)}")
+
+
+# ========== Sliding-window histograms ==========
+class SlidingHistogram:
+    """
+    Histogram of a window that moves over an image (or over time)
+    
+    Pixels entering and leaving the window are added and removed, so
+    moving it costs as much as its changed border rather than its area.
+    Percentile queries follow Huang's running median: the gray level of
+    the last answer and the number of pixels below it are kept up to date
+    by add() and remove(), and the next query starts from there, so
+    successive queries on a slowly changing window take only a few steps.
+    """
+    
+    def __init__(self, levels=256):
+        self.hist = np.zeros(levels, dtype=np.int64)
+        self.count = 0
+        self._level = 0   # gray level of the last percentile query
+        self._below = 0   # pixels in the window darker than _level
+    
+    def add(self, region):
+        """
+        Counts the pixels of region (an array of any shape) into the window
+        """
+        values = np.asarray(region).ravel()
+        np.add.at(self.hist, values, 1)
+        self.count += values.size
+        self._below += int(np.count_nonzero(values < self._level))
+        return self
+    
+    def remove(self, region):
+        """
+        Removes the pixels of region from the window; they must have been
+        added before
+        """
+        values = np.asarray(region).ravel()
+        np.subtract.at(self.hist, values, 1)
+        self.count -= values.size
+        self._below -= int(np.count_nonzero(values < self._level))
+        return self
+    
+    def percentile(self, percentile):
+        """
+        Returns the gray level at the given percentile of the window (the
+        same as np.percentile with method="lower")
+        """
+        if not 0 <= percentile <= 100:
+            raise ValueError("percentile must be between 0 and 100")
+        if self.count == 0:
+            raise ValueError("The window is empty")
+        rank = int(percentile / 100 * (self.count - 1))
+        hist, level, below = self.hist, self._level, self._below
+        while below > rank:
+            level -= 1
+            below -= int(hist[level])
+        while below + hist[level] <= rank:
+            below += int(hist[level])
+            level += 1
+        self._level, self._below = level, below
+        return level
+    
+    def median(self):
+        """
+        Returns the (lower) median gray level of the window
+        """
+        return self.percentile(50.0)
+
+
+def percentile_filter(img, radius, percentile=50.0):
+    """
+    Replaces every pixel by the given percentile of its (2*radius+1)^2
+    neighborhood, replicating the border pixels
+    
+    The window visits the image in a serpentine order (left to right, one
+    row down, right to left, ...), so every step only moves one column or
+    one row of pixels through a SlidingHistogram.
+    """
+    if img.ndim != 2:
+        raise ValueError("img must be a 2D grayscale image")
+    if img.dtype == np.uint8:
+        levels = 256
+    elif img.dtype == np.uint16:
+        levels = 65536
+    else:
+        raise ValueError("img must be uint8 or uint16")
+    if not 0 <= percentile <= 100:
+        raise ValueError("percentile must be between 0 and 100")
+    
+    size = 2 * radius + 1
+    padded = np.pad(img, radius, mode="edge")
+    dst = np.empty_like(img)
+    height, width = img.shape
+    
+    window = SlidingHistogram(levels).add(padded[:size, :size])
+    for y in range(height):
+        rows = padded[y:y + size]
+        if y % 2 == 0:
+            for x in range(width):
+                if x > 0:
+                    window.remove(rows[:, x - 1])
+                    window.add(rows[:, x + size - 1])
+                dst[y, x] = window.percentile(percentile)
+        else:
+            for x in range(width - 1, -1, -1):
+                if x < width - 1:
+                    window.remove(rows[:, x + size])
+                    window.add(rows[:, x])
+                dst[y, x] = window.percentile(percentile)
+        if y + 1 < height:
+            # x is the column the row ended on
+            window.remove(padded[y, x:x + size])
+            window.add(padded[y + size, x:x + size])
+    return dst
+
+
+def median_filter(img, radius):
+    """
+    Median filter over (2*radius+1)^2 neighborhoods, see percentile_filter()
+    """
+    return percentile_filter(img, radius, 50.0)
+
+
+def test_sliding_histogram():
+    """
+    Checks the sliding median against OpenCV and against recounting every
+    window with calculate_histogram
+    """
+    rng = np.random.default_rng(0)
+    img = generate_synthetic_image("gradient", 96, 128)
+    noisy = img.copy()
+    noisy[rng.random(img.shape) < 0.05] = 255   # salt noise
+    
+    start = time.perf_counter()
+    filtered = median_filter(noisy, 2)
+    sliding_time = time.perf_counter() - start
+    print(f"Median filter equals cv2.medianBlur: "
+          f"{np.array_equal(filtered, cv2.medianBlur(noisy, 5))}")
+    
+    # The same for a few rows, recounting each window from scratch
+    padded = np.pad(noisy, 2, mode="edge")
+    start = time.perf_counter()
+    for y in range(8):
+        for x in range(noisy.shape[1]):
+            hist = calculate_histogram(padded[y:y + 5, x:x + 5])
+            assert _histogram_percentile(hist, 50.0) == filtered[y, x]
+    recount_time = (time.perf_counter() - start) * noisy.shape[0] / 8
+    print(f"Sliding: {sliding_time:.3f}s, recounting (estimated): {recount_time:.3f}s")
+    
+    # Temporal use: 90th percentile over the last 10 frames of a recording
+    window = SlidingHistogram()
+    recent = []
+    for frame in synthetic_frames(30, 64, 64):
+        window.add(frame)
+        recent.append(frame)
+        if len(recent) > 10:
+            window.remove(recent.pop(0))
+    expected = int(np.percentile(np.stack(recent), 90, method="lower"))
+    print(f"Temporal 90th percentile: {window.percentile(90)} (expected {expected})")
+
+
+# ========== Frame stream processing ==========
+class BufferPool:
+    """
+    Fixed set of reusable frame buffers
+    
+    acquire() blocks while all buffers are in use, which also gives the
+    pipeline its backpressure: the reader cannot run further ahead of the
+    writer than the number of buffers.
+    """
+    
+    def __init__(self, shape, dtype, count):
+        self._free = queue.Queue()
+        for _ in range(count):
+            self._free.put(np.empty(shape, dtype=dtype))
+    
+    def acquire(self):
+        """Returns a free buffer, waiting until one is released if needed"""
+        return self._free.get()
+    
+    def release(self, buf):
+        """Returns buf to the pool once nothing uses it anymore"""
+        self._free.put(buf)
+
+
+class StageCounter:
+    """Frames handled and seconds spent busy by one pipeline stage"""
+    
+    def __init__(self):
+        self.frames = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+    
+    def add(self, seconds):
+        """Records one frame that took seconds to handle"""
+        with self._lock:
+            self.frames += 1
+            self.busy += seconds
+    
+    def fps(self):
+        """Frames per second of busy time (the stage's own throughput)"""
+        return self.frames / self.busy if self.busy > 0 else float("inf")
+
+
+class FramePipeline:
+    """
+    Processes a stream of frames with reader, worker and writer stages
+    
+    The reader pulls frames from the source, the workers (a pool of
+    threads; NumPy and OpenCV release the GIL) run process(frame, out) on
+    them, and the writer hands the results to the sink in the original
+    frame order. Stages are connected by bounded queues, and output frames
+    come from a BufferPool, so memory use is fixed no matter how long the
+    recording is.
+    
+    process(frame, out) must write the output frame into out (a pooled
+    buffer) and may return an extra result, e.g. a histogram. sink(index,
+    out, extra) must not keep out after it returns, since the buffer is
+    reused.
+    """
+    
+    def __init__(self, process, workers=4, queue_size=8, out_dtype=None):
+        self.process = process
+        self.workers = workers
+        self.queue_size = queue_size
+        self.out_dtype = out_dtype
+        self.counters = {}
+    
+    def run(self, source, sink):
+        """
+        Runs the pipeline until the source is exhausted
+        
+        Parameters:
+        source: iterable of frames, or the path of a video file (decoded
+                with cv2.VideoCapture and converted to grayscale)
+        sink: callable(index, out, extra) called in frame order; if it (or
+              process) raises, the other stages are shut down and the
+              exception is re-raised
+        
+        Returns:
+        dict of StageCounter for "reader", "worker" and "writer", plus the
+        overall "fps"
+        """
+        frames = _video_frames(source) if isinstance(source, str) else iter(source)
+        t0 = time.perf_counter()
+        first = next(frames, None)
+        first_read = time.perf_counter() - t0
+        self.counters = {name: StageCounter() for name in ("reader", "worker", "writer")}
+        if first is None:
+            return dict(self.counters, fps=0.0)
+        
+        in_queue = queue.Queue(self.queue_size)
+        out_queue = queue.Queue(self.queue_size)
+        # Enough buffers for every frame that can be in flight at once
+        in_flight = 2 * self.queue_size + self.workers + 1
+        out_pool = BufferPool(first.shape, self.out_dtype or first.dtype, in_flight)
+        errors = []
+        start = time.perf_counter()
+        
+        def reader():
+            try:
+                index = 0
+                frame, read_time = first, first_read
+                while frame is not None and not errors:
+                    # Only reading counts: waiting for a buffer or queue slot
+                    # is backpressure, not reader work
+                    self.counters["reader"].add(read_time)
+                    # Buffers are taken in frame order, so the oldest frame in
+                    # flight always has one and the writer can make progress
+                    out = out_pool.acquire()
+                    in_queue.put((index, frame, out))
+                    index += 1
+                    t0 = time.perf_counter()
+                    frame = next(frames, None)
+                    read_time = time.perf_counter() - t0
+            except Exception as e:
+                errors.append(e)
+            finally:
+                for _ in range(self.workers):
+                    in_queue.put(None)
+        
+        def worker():
+            while True:
+                item = in_queue.get()
+                if item is None:
+                    out_queue.put(None)
+                    return
+                index, frame, out = item
+                t0 = time.perf_counter()
+                try:
+                    # After an error the remaining frames are only passed on
+                    extra = None if errors else self.process(frame, out)
+                except Exception as e:
+                    errors.append(e)
+                    extra = None
+                self.counters["worker"].add(time.perf_counter() - t0)
+                out_queue.put((index, out, extra))
+        
+        threads = [threading.Thread(target=reader)]
+        threads += [threading.Thread(target=worker) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        
+        # Writer: runs in the calling thread and restores frame order
+        pending = {}
+        next_index = 0
+        finished = 0
+        try:
+            while finished < self.workers:
+                item = out_queue.get()
+                if item is None:
+                    finished += 1
+                    continue
+                pending[item[0]] = item
+                while next_index in pending:
+                    index, out, extra = pending.pop(next_index)
+                    t0 = time.perf_counter()
+                    try:
+                        if not errors:
+                            sink(index, out, extra)
+                    finally:
+                        self.counters["writer"].add(time.perf_counter() - t0)
+                        out_pool.release(out)
+                    next_index += 1
+        except BaseException as e:
+            errors.append(e)
+            raise
+        finally:
+            # Give back the buffers of frames that will never be written, then
+            # keep draining, so a reader blocked on the pool or a worker
+            # blocked on out_queue can reach its sentinel and exit
+            for _, out, _ in pending.values():
+                out_pool.release(out)
+            pending.clear()
+            while finished < self.workers:
+                item = out_queue.get()
+                if item is None:
+                    finished += 1
+                else:
+                    out_pool.release(item[1])
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+        
+        elapsed = time.perf_counter() - start
+        return dict(self.counters, fps=next_index / elapsed if elapsed > 0 else 0.0)
+
+
+def _video_frames(path):
+    """
+    Yields the frames of a video file as grayscale images
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video: {path}")
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    finally:
+        capture.release()
+
+
+def synthetic_frames(count, height=480, width=640):
+    """
+    Yields count moving gradient frames, as a stand-in for a recording
+    """
+    gradient = create_gradient_image(height, width)
+    for i in range(count):
+        yield np.roll(gradient, i, axis=1)
+
+
+def test_frame_pipeline():
+    """
+    Brightens, normalizes and histograms a synthetic recording
+    """
+    ops = PointOps().add(40, "cv2").normalize()
+    
+    def process(frame, out):
+        ops.apply(frame, out=out)
+        return calculate_histogram(out)
+    
+    checksums = []
+    
+    def sink(index, out, hist):
+        checksums.append((index, int(out.sum()), int(hist[255])))
+    
+    pipeline = FramePipeline(process, workers=4, queue_size=8)
+    stats = pipeline.run(synthetic_frames(200), sink)
+    
+    expected = [(i, int(frame.sum()), int(calculate_histogram(frame)[255]))
+                for i, frame in enumerate(ops.apply(f) for f in synthetic_frames(200))]
+    print(f"Frames in order and identical to a plain loop: {checksums == expected}")
+    print(f"Overall: {stats['fps']:.1f} frames/s")
+    for name in ("reader", "worker", "writer"):
+        counter = stats[name]
+        print(f"  {name:<6}: {counter.frames} frames, {counter.fps():.1f} frames/s per thread")
+    
+    # A failing sink stops the whole pipeline instead of leaving threads behind
+    def failing_sink(index, out, hist):
+        if index == 3:
+            raise RuntimeError("sink failed")
+    
+    threads_before = threading.active_count()
+    try:
+        pipeline.run(synthetic_frames(200), failing_sink)
+    except RuntimeError as e:
+        print(f"Sink error re-raised: {e}, "
+              f"threads left running: {threading.active_count() - threads_before}")  # Should be 0
+    
+    # The same when a slow frame has let the later ones use up every buffer
+    # before the sink fails on it
+    def slow_process(frame, out):
+        if frame[0, 0] == 5:
+            time.sleep(0.5)
+        out[:] = frame
+    
+    def failing_slow_sink(index, out, extra):
+        if index == 5:
+            raise RuntimeError("sink failed on the slow frame")
+    
+    numbered = (np.full((4, 4), i, dtype=np.uint8) for i in range(100))
+    try:
+        FramePipeline(slow_process, workers=4, queue_size=8).run(numbered, failing_slow_sink)
+    except RuntimeError as e:
+        print(f"Sink error re-raised: {e}, "
+              f"threads left running: {threading.active_count() - threads_before}")  # Should be 0
+
+
 # ========== Running all questions ==========
 def main():
     print("=== Question 1: Creating gradient image ===")
@@ -301,6 +1357,18 @@ def main():
     print("\n=== Question 7: Calculating and displaying histogram ===")
     test_img = create_gradient_image(200, 300)
     display_histogram(test_img)
+    
+    print("\n=== Fused point operations ===")
+    test_point_ops()
+    
+    print("\n=== Frame stream pipeline ===")
+    test_frame_pipeline()
+    
+    print("\n=== Sliding-window histograms ===")
+    test_sliding_histogram()
+    
+    print("\n=== Color histograms ===")
+    test_channel_histograms()
 
 
 if __name__ == "__main__":